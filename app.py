@@ -4,26 +4,171 @@ import json
 import time
 import random
 import logging
+import logging.handlers
+import atexit
+import shutil
 import os
 from datetime import datetime
-from PIL import Image
+from PIL import Image, ImageFilter, features
 import io
 import base64
+import html
+import gzip
+import mmap
+import re
+import struct
+import sys
+from bisect import bisect_left, bisect_right
+import hashlib
+import secrets
+import sqlite3
+import zlib
+import threading
+import heapq
+import itertools
+import contextlib
+import copy
+import functools
+import queue
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-# Set up logging
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-log_filename = f"{log_dir}/svomo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename),
-        logging.StreamHandler()
-    ]
-)
+# Logging settings: size-based rotation with gzip-compressed archives, and the
+# share of high-volume per-rerun messages that is kept. Each process writes and
+# rotates its own svomo-<pid>.log, since RotatingFileHandler can't safely share
+# one file between processes. At startup, files left by other processes are
+# deleted once they haven't been written for LOG_RETENTION seconds.
+LOG_DIR = "logs"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 10
+LOG_RETENTION = 7 * 24 * 60 * 60
+LOG_SAMPLE_RATE = st.secrets.get("LOG_SAMPLE_RATE", 0.1)
+
+# Rotating file handler that gzips each rotated file
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = self._compress
+    
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, "rb") as source_file, gzip.open(dest, "wb") as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+        os.remove(source)
+
+# Format records as one JSON object per line, including any structured extras
+class JsonLogFormatter(logging.Formatter):
+    EXTRA_FIELDS = ("session_id", "step", "duration_ms", "endpoint", "purpose")
+    
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False)
 
+# Tag records with the Streamlit session and step they were logged from, and
+# drop most records marked with extra={"sample": True}
+class SessionContextFilter(logging.Filter):
+    def filter(self, record):
+        if getattr(record, "sample", False) and random.random() >= LOG_SAMPLE_RATE:
+            return False
+        
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx:
+            record.session_id = ctx.session_id
+            try:
+                record.step = ctx.session_state["step"]
+            except Exception:
+                pass
+        return True
+
+# Queue handler that renders the message and traceback before a record crosses
+# threads. The stock prepare() folds the traceback into the message and clears
+# exc_info; here it is kept in exc_text so the listener's formatters still
+# print it in their own field.
+class TracebackQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+# Delete other processes' log files, rotated archives included, that haven't been
+# written for LOG_RETENTION seconds. Returns how many were deleted.
+def prune_stale_logs(own_name):
+    cutoff = time.time() - LOG_RETENTION
+    pruned = 0
+    for entry in os.scandir(LOG_DIR):
+        if not entry.name.startswith("svomo-") or ".log" not in entry.name or entry.name.startswith(own_name):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                pruned += 1
+        except OSError:
+            # Another process pruned it first
+            pass
+    return pruned
+
+# Set up logging once per process. Records are queued from the script and
+# worker threads and written by a background listener thread. A second copy of
+# this module (loadtest.py imports it next to the running script) reuses the
+# handlers the first one attached.
+@st.cache_resource
+def setup_logging():
+    app_logger = logging.getLogger("svomo")
+    if getattr(app_logger, "log_path", None):
+        return app_logger.log_path
+    
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_path = os.path.join(LOG_DIR, f"svomo-{os.getpid()}.log")
+    pruned = prune_stale_logs(os.path.basename(log_path))
+    
+    file_handler = CompressedRotatingFileHandler(log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(JsonLogFormatter())
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    queue_handler = TracebackQueueHandler(log_queue)
+    queue_handler.addFilter(SessionContextFilter())
+    
+    app_logger.setLevel(logging.INFO)
+    app_logger.addHandler(queue_handler)
+    app_logger.propagate = False
+    app_logger.log_path = log_path
+    if pruned:
+        app_logger.info(f"Deleted {pruned} log files not written for {LOG_RETENTION // 86400} days")
+    
+    return log_path
+
+log_filename = setup_logging()
 logger = logging.getLogger("svomo")
 
 # Set page configuration
@@ -38,264 +183,1146 @@ st.set_page_config(
 TMDB_API_KEY = st.secrets["TMDB_API_KEY"]
 GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
 
-# Define API endpoints
-TMDB_BASE_URL = "https://api.themoviedb.org/3"
-GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+# Define API endpoints (overridable in secrets, e.g. to point at local stand-in servers)
+TMDB_BASE_URL = st.secrets.get("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+GEMINI_BASE_URL = st.secrets.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent")
+
+# Gemini settings per call purpose (override with GEMINI_ROUTES in secrets.toml):
+# the output cap and temperature, the request timeout in seconds, and optionally
+# a model, e.g. "gemini-2.0-flash-lite" for the cheaper purposes. Without a
+# "model" a route uses the GEMINI_BASE_URL model. Purposes that must return
+# complete JSON (questions, recommendations, description_batch) have no output
+# cap, since a truncated answer can't be parsed.
+GEMINI_ROUTES = dict(st.secrets.get("GEMINI_ROUTES", {
+    "questions": {"temperature": 1.0, "timeout": 20},
+    "recommendations": {"temperature": 0.7, "timeout": 30},
+    "descriptions": {"max_output_tokens": 256, "temperature": 0.9, "timeout": 15},
+    "description_batch": {"temperature": 0.9, "timeout": 25},
+}))
+GEMINI_JSON_PURPOSES = {"questions", "recommendations", "description_batch"}
 
 # Default image for missing posters
 DEFAULT_IMAGE_URL = "https://i.ibb.co/s9ZYS5wk/45e6544ed099.jpg"
 
-# Custom CSS for retro style UI
+# Send Gemini requests with temperature 0. Identical prompts then give the same
+# answer, so concurrent identical calls are coalesced into one request.
+GEMINI_DETERMINISTIC = st.secrets.get("GEMINI_DETERMINISTIC", False)
+
+# Hedge slow Gemini calls: once a call has run past the HEDGE_PERCENTILE latency
+# seen for its purpose, send a duplicate and take whichever answers first.
+# Hedges are capped at HEDGE_BUDGET extra requests per call.
+GEMINI_HEDGING = st.secrets.get("GEMINI_HEDGING", False)
+HEDGE_PERCENTILE = 0.9
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.5
+HEDGE_BUDGET = st.secrets.get("HEDGE_BUDGET", 0.1)
+HEDGE_WORKERS = 32
+
+# Ask Gemini for schema-validated JSON recommendations (with a short pitch per title)
+# instead of extracting JSON from free text and describing each title separately.
+# Off by default; enable with GEMINI_STRUCTURED_OUTPUT = true in secrets.toml
+GEMINI_STRUCTURED_OUTPUT = st.secrets.get("GEMINI_STRUCTURED_OUTPUT", False)
+
+# Questions used when Gemini's response can't be parsed
+DEFAULT_QUESTIONS = [
+    {
+        "question": "Are you watching alone or with someone?",
+        "options": ["Alone", "With friends", "With family", "With a partner"]
+    },
+    {
+        "question": "What's your current mood?",
+        "options": ["Happy", "Relaxed", "Sad", "Excited", "Thoughtful"]
+    },
+    {
+        "question": "Do you prefer older classics or newer releases?",
+        "options": ["Classics", "Recent releases", "Both"]
+    },
+    {
+        "question": "How much time do you have?",
+        "options": ["Under 2 hours", "2-3 hours", "I have all day"]
+    },
+    {
+        "question": "What kind of ending do you prefer?",
+        "options": ["Happy", "Thought-provoking", "Doesn't matter"]
+    }
+]
+
+# Personas offered on the intro screen
+PERSONA_OPTIONS = [
+    "Movie Fan - Hollywood",
+    "Movie Fan - Bollywood",
+    "Movie Fan - Korean",
+    "Movie Fan - Japanese",
+    "Anime Enthusiast",
+    "TV Series Binger",
+    "Documentary Lover",
+    "Indie Film Aficionado"
+]
+
+# Pre-generated question sets: fresh sets kept per persona, refill threshold,
+# minimum questions per valid set and background generation workers
+QUESTION_POOL_SIZE = st.secrets.get("QUESTION_POOL_SIZE", 3)
+QUESTION_POOL_LOW_WATER = 1
+QUESTION_SET_MIN_LENGTH = 5
+QUESTION_POOL_WORKERS = 2
+# Generated question sets are saved here so a restarted process starts with a warm pool
+QUESTION_POOL_PATH = st.secrets.get("QUESTION_POOL_PATH", "cache/question_sets.json")
+
+# Speculative recommendation prefetch during the questionnaire (opt-in).
+# Once only the last question is left, one run starts per option of it, if it
+# has at most SPECULATIVE_MAX_BRANCHES options. At the end, the run built from
+# exactly the final answers is used and the others are cancelled.
+# Each branch is a full recommendation run holding one of the SPECULATIVE_WORKERS
+# threads, so two sessions at the last question can fill the pool and a third
+# session's runs queue behind them. A run that hasn't started when it's needed
+# is dropped for a normal run; one under way is waited on for at most
+# SPECULATIVE_MAX_WAIT seconds (override with SPECULATIVE_MAX_WAIT in secrets.toml).
+SPECULATIVE_PREFETCH = st.secrets.get("SPECULATIVE_PREFETCH", False)
+SPECULATIVE_MAX_BRANCHES = st.secrets.get("SPECULATIVE_MAX_BRANCHES", 4)
+SPECULATIVE_MAX_WAIT = st.secrets.get("SPECULATIVE_MAX_WAIT", 20)
+SPECULATIVE_WORKERS = 8
+
+# Persistent recommendation cache (SQLite on local disk)
+RECOMMENDATION_CACHE_PATH = st.secrets.get("RECOMMENDATION_CACHE_PATH", "cache/recommendations.sqlite3")
+RECOMMENDATION_CACHE_TTL = 7 * 24 * 60 * 60
+RECOMMENDATION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Process-wide store of title details shared by every session, which only keeps
+# TMDB ids (override with MEDIA_STORE_MAX_ENTRIES in secrets.toml). Evicted
+# titles are fetched again, usually from the TMDB cache.
+MEDIA_STORE_MAX_ENTRIES = st.secrets.get("MEDIA_STORE_MAX_ENTRIES", 20000)
+
+# Most recommendations one session can accumulate through LOAD MORE
+# (override with MAX_SESSION_RECOMMENDATIONS in secrets.toml)
+MAX_SESSION_RECOMMENDATIONS = st.secrets.get("MAX_SESSION_RECOMMENDATIONS", 60)
+
+# Session store that lets any replica resume a session from the ?session= token
+# in its URL. Off by default: set SESSION_STORE = "sqlite" in secrets.toml to
+# enable it. Replicas on one host can share the SQLite file; spreading across
+# hosts needs a backend on shared storage. Saves are written in the background,
+# and any database access waits at most SESSION_STORE_TIMEOUT seconds for a lock.
+SESSION_STORE = st.secrets.get("SESSION_STORE", "none")
+SESSION_STORE_PATH = st.secrets.get("SESSION_STORE_PATH", "cache/sessions.sqlite3")
+SESSION_STORE_TTL = 24 * 60 * 60
+SESSION_STORE_TIMEOUT = 0.5
+SESSION_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+# Offline title index built from TMDB's daily ID exports (gzip JSONL). Those
+# carry each title's original title and popularity but no display title or date,
+# so the index only proposes candidate ids: each one is confirmed against its
+# movie/{id} or tv/{id} details, which resolving the title fetches anyway, and at
+# most TITLE_INDEX_MAX_CANDIDATES are checked per lookup. Exports enriched with
+# "title"/"name" and a release date are indexed on those as well. The index is
+# rebuilt in the background whenever an export file is newer than it.
+TITLE_INDEX_PATH = st.secrets.get("TITLE_INDEX_PATH", "data/title_index.bin")
+TITLE_INDEX_MAX_CANDIDATES = 2
+TITLE_INDEX_EXPORTS = dict(st.secrets.get("TITLE_INDEX_EXPORTS", {
+    "movie": "data/movie_ids.json.gz",
+    "tv": "data/tv_series_ids.json.gz",
+}))
+
+# Files under static/ next to this script are served by Streamlit at app/static
+# (enableStaticServing in .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL = "app/static"
+
+# Self-hosted theme fonts, relative to static/. Missing files are downloaded
+# from Google Fonts in the background the first time the theme is built.
+THEME_FONTS_CSS_URL = "https://fonts.googleapis.com/css2"
+THEME_FONTS = {
+    "VT323": "fonts/VT323-Regular.woff2",
+    "Press Start 2P": "fonts/PressStart2P-Regular.woff2",
+}
+
+# Poster proxy: width posters are shown at, and the on-disk cache of re-encoded
+# thumbnails (kept under static/ so the browser can load them directly)
+POSTER_DISPLAY_WIDTH = 200
+POSTER_CACHE_DIR = os.path.join(STATIC_DIR, "posters")
+POSTER_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Width of the blurred low-quality placeholder shown while a poster loads
+POSTER_PLACEHOLDER_WIDTH = 16
+
+# Stream recommendations from Gemini and show each card as soon as it is resolved
+# (streamed recommendations always use the structured response schema below).
+# Off by default; enable with GEMINI_STREAMING = true in secrets.toml
+GEMINI_STREAMING = st.secrets.get("GEMINI_STREAMING", False)
+
+# Response schema for structured recommendations
+RECOMMENDATION_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "title": {"type": "STRING"},
+            "year": {"type": "STRING"},
+            "media_type": {"type": "STRING", "enum": ["movie", "tv"]},
+            "reason": {"type": "STRING"},
+            "pitch": {"type": "STRING"}
+        },
+        "required": ["title", "year", "media_type", "reason", "pitch"],
+        "propertyOrdering": ["title", "year", "media_type", "reason", "pitch"]
+    }
+}
+
+# Prometheus text-format metrics file, rewritten every METRICS_EXPORT_INTERVAL seconds.
+# Each process writes its own file ({pid} in the path is replaced by the process
+# id) and labels its series with its pid, so a textfile collector can read every
+# replica's file side by side. serve.py serves the file at /metrics as well.
+METRICS_EXPORT_PATH = st.secrets.get("METRICS_EXPORT_PATH", "metrics/svomo-{pid}.prom")
+METRICS_EXPORT_INTERVAL = 15
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_SAMPLE_WINDOW = 1024
+
+# HTTP connection pool sizes per upstream host (override with HTTP_POOL_SIZES in secrets.toml)
+HTTP_POOL_SIZES = dict(st.secrets.get("HTTP_POOL_SIZES", {
+    "api.themoviedb.org": 20,
+    "generativelanguage.googleapis.com": 10,
+}))
+HTTP_DEFAULT_POOL_SIZE = 10
+
+# Retry settings for transient upstream failures
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 8.0
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+HTTP_TIMEOUT = 30
+# Retries stop once another backoff would take a request past this many seconds
+HTTP_RETRY_BUDGET = 20
+# Methods safe to resend after a read timeout; anything else may already have been processed
+HTTP_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Process-wide rate limits per upstream (override with RATE_LIMITS in secrets.toml).
+# Each rate is a token bucket holding `burst` (default: one second's worth);
+# requests wait up to RATE_LIMIT_MAX_WAIT seconds for their turn.
+RATE_LIMITS = dict(st.secrets.get("RATE_LIMITS", {
+    "tmdb": {"requests_per_second": 40, "burst": 20},
+    "gemini": {"requests_per_minute": 1000, "tokens_per_minute": 1000000},
+}))
+RATE_LIMIT_MAX_WAIT = st.secrets.get("RATE_LIMIT_MAX_WAIT", 60)
+GEMINI_RESPONSE_TOKEN_ESTIMATE = 512
+
+# Circuit breakers per upstream (override with CIRCUIT_BREAKERS in secrets.toml).
+# A breaker opens once failure_ratio of the last `window` calls (at least
+# min_calls) failed or took longer than slow_call_seconds; while open, a
+# background probe retries the upstream every open_seconds.
+CIRCUIT_BREAKERS = dict(st.secrets.get("CIRCUIT_BREAKERS", {
+    "tmdb": {"window": 20, "min_calls": 10, "failure_ratio": 0.5, "slow_call_seconds": 5, "open_seconds": 15},
+    "gemini": {"window": 20, "min_calls": 5, "failure_ratio": 0.5, "slow_call_seconds": 25, "open_seconds": 30},
+}))
+
+# While a breaker is open, responses up to this long past their TTL are served
+# instead; older ones are dropped from the caches. Gemini keeps its last good
+# responses within its own byte budget, for purposes where an earlier answer to
+# the same prompt is as good as a new one (questions want fresh variety).
+STALE_MAX_AGE = 24 * 60 * 60
+STALE_SWEEP_INTERVAL = 60
+GEMINI_STALE_MAX_BYTES = 16 * 1024 * 1024
+GEMINI_STALE_PURPOSES = {"recommendations", "descriptions", "description_batch"}
+
+# Rate-limit priority classes; waiting requests are served lowest value first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_SPECULATIVE = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BACKGROUND: "background",
+    PRIORITY_SPECULATIVE: "speculative",
+}
+
+# TMDB response cache: TTL in seconds per endpoint prefix, and total size budget
+TMDB_CACHE_TTLS = {
+    "configuration": 24 * 60 * 60,
+    "movie/": 6 * 60 * 60,
+    "tv/": 6 * 60 * 60,
+    "search/": 60 * 60,
+}
+TMDB_CACHE_DEFAULT_TTL = 10 * 60
+TMDB_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Worker pool for resolving recommendations: process-wide size and per-session cap
+RESOLVE_POOL_WORKERS = 32
+RESOLVE_MAX_CONCURRENCY_PER_SESSION = 4
+
+# Download the Latin woff2 file for each missing theme font into static/fonts
+def fetch_theme_fonts(families):
+    # Google Fonts only serves woff2 to browsers it recognises
+    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"}
+    fetched = 0
+    for family in families:
+        try:
+            response = get_http_client().get(THEME_FONTS_CSS_URL, params={"family": family, "display": "swap"}, headers=headers)
+            response.raise_for_status()
+            # The stylesheet has one @font-face per subset, each preceded by a /* subset */ comment
+            subsets = dict(re.findall(r"/\*\s*([\w-]+)\s*\*/\s*@font-face\s*\{[^}]*?url\((https://[^)]+\.woff2)\)", response.text))
+            font_url = subsets.get("latin")
+            if not font_url:
+                logger.warning(f"No Latin woff2 file found for font {family}")
+                continue
+            
+            font_response = get_http_client().get(font_url)
+            font_response.raise_for_status()
+            path = os.path.join(STATIC_DIR, THEME_FONTS[family])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as font_file:
+                font_file.write(font_response.content)
+            os.replace(temp_path, path)
+            fetched += 1
+            logger.info(f"Fetched theme font {family} ({len(font_response.content)} bytes)")
+        except Exception as e:
+            logger.error(f"Error fetching theme font {family}: {e}")
+    return fetched
+
+# Fetch missing fonts off the request path, then rebuild the stylesheet so the
+# next rerun links the self-hosted copies
+def start_theme_font_fetch(families):
+    def fetch():
+        if fetch_theme_fonts(families):
+            get_theme_stylesheet_url.clear()
+    
+    threading.Thread(target=fetch, name="svomo-theme-fonts", daemon=True).start()
+
+# Build the minified, content-versioned theme stylesheet under static/build and
+# return its URL. Self-hosted font files in static/fonts are used when present;
+# missing ones come from Google Fonts until the background fetch has stored them.
+def build_theme_css():
+    with open(os.path.join(STATIC_DIR, "css", "retro.css"), encoding="utf-8") as css_file:
+        css = css_file.read()
+    
+    font_rules = []
+    missing_fonts = []
+    for family, font_path in THEME_FONTS.items():
+        if os.path.exists(os.path.join(STATIC_DIR, font_path)):
+            font_rules.append(
+                f"@font-face {{ font-family: '{family}'; font-style: normal; font-weight: 400; "
+                f"font-display: swap; src: url('../{font_path}') format('woff2'); }}"
+            )
+        else:
+            missing_fonts.append(family)
+    if missing_fonts:
+        logger.warning(f"Self-hosted fonts missing for {', '.join(missing_fonts)}, falling back to Google Fonts while they are fetched")
+        start_theme_font_fetch(missing_fonts)
+        families = "&".join(f"family={family.replace(' ', '+')}" for family in missing_fonts)
+        # @import has to come before every other rule
+        font_rules.insert(0, f"@import url('https://fonts.googleapis.com/css2?{families}&display=swap');")
+    
+    css = minify_css("\n".join(font_rules) + "\n" + css)
+    version = hashlib.sha1(css.encode("utf-8")).hexdigest()[:10]
+    filename = f"retro.{version}.min.css"
+    
+    build_dir = os.path.join(STATIC_DIR, "build")
+    os.makedirs(build_dir, exist_ok=True)
+    path = os.path.join(build_dir, filename)
+    if not os.path.exists(path):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as css_file:
+            css_file.write(css)
+        os.replace(temp_path, path)
+        logger.info(f"Built theme stylesheet {filename} ({len(css)} bytes)")
+    
+    return f"{STATIC_URL}/build/{filename}"
+
+# Minify CSS: drop comments and whitespace that carries no meaning. A space
+# before ":" is only dropped inside declaration blocks, since in a selector it
+# is a descendant combinator ("a :hover" is not "a:hover").
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    css = re.sub(r"\{[^{}]*\}", lambda block: re.sub(r"\s+:", ":", block.group(0)), css)
+    css = css.replace(";}", "}")
+    return css.strip()
+
+# Theme stylesheet URL, built once per process
+@st.cache_resource
+def get_theme_stylesheet_url():
+    return build_theme_css()
+
+# Custom CSS for retro style UI. Only a link to the cached stylesheet is sent
+# on each rerun.
 def load_custom_css():
-    st.markdown("""
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=VT323&family=Press+Start+2P&display=swap');
-        
-        * {
-            font-family: 'VT323', monospace;
-        }
-        
-        h1, h2, h3 {
-            font-family: 'Press Start 2P', cursive;
-            color: #39FF14;
-            text-shadow: 0 0 5px #39FF14, 0 0 10px #39FF14;
-        }
-        
-        .stButton button {
-            background-color: #FF00FF;
-            color: #000000;
-            border: 2px solid #00FFFF;
-            border-radius: 0px;
-            font-family: 'Press Start 2P', cursive;
-            font-size: 14px;
-            padding: 10px 20px;
-            margin: 10px 0px;
-            cursor: pointer;
-            box-shadow: 0 0 10px #FF00FF;
-            transition: all 0.3s;
-        }
-        
-        .stButton button:hover {
-            background-color: #00FFFF;
-            color: #000000;
-            border: 2px solid #FF00FF;
-            box-shadow: 0 0 20px #00FFFF;
-            transform: translateY(-2px);
-        }
-        
-        .retro-card {
-            background-color: rgba(0, 0, 0, 0.7);
-            border: 2px solid #39FF14;
-            border-radius: 0px;
-            padding: 20px;
-            margin: 10px 0px;
-            color: #FFFFFF;
-            box-shadow: 0 0 15px rgba(57, 255, 20, 0.5);
-            animation: glow 3s infinite alternate;
-        }
+    st.markdown(f"""
+    <link rel="stylesheet" href="{get_theme_stylesheet_url()}">
+    <div class="retro-background"></div>
+    <div class="retro-grid"></div>
+    <div class="scanlines"></div>
+    """, unsafe_allow_html=True)
+
+# Display loading animation
+def loading_animation():
+    st.markdown('<div class="loading-animation"></div>', unsafe_allow_html=True)
+
+# Latency histogram for one metric/label combination. Recent samples are kept
+# as well so percentiles can be reported without bucket interpolation.
+class LatencySeries:
+    def __init__(self, buckets, window):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=window)
+    
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+# Process-wide latency and call-count metrics, exported in Prometheus text format
+class MetricsRegistry:
+    HELP = {
+        "svomo_tmdb_request_seconds": "TMDB API request latency by endpoint template",
+        "svomo_gemini_request_seconds": "Gemini API request latency by call purpose and model",
+        "svomo_gemini_tokens_total": "Gemini tokens used by call purpose, model and direction",
+        "svomo_step_seconds": "Time spent rendering each app step",
+        "svomo_rate_limit_wait_seconds": "Time requests waited for an upstream rate limit",
+        "svomo_rate_limit_queue_depth": "Requests currently waiting for an upstream rate limit",
+    }
+    
+    def __init__(self, buckets, window):
+        self.buckets = buckets
+        self.window = window
+        self._series = {}
+        self._gauges = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, name, labels, seconds, error=False):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = LatencySeries(self.buckets, self.window)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series.bucket_counts[i] += 1
+            series.count += 1
+            series.total += seconds
+            series.samples.append(seconds)
+            if error:
+                series.errors += 1
+    
+    # Latency percentile of one series, or None until it has min_count samples
+    def percentile(self, name, labels, fraction, min_count=1):
+        with self._lock:
+            series = self._series.get((name, tuple(sorted(labels.items()))))
+            if series is None or len(series.samples) < min_count:
+                return None
+            return series.percentile(fraction)
+    
+    def set_gauge(self, name, labels, value):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+    
+    def increment(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def counters(self, name):
+        with self._lock:
+            return [(dict(labels), value) for (counter_name, labels), value in sorted(self._counters.items()) if counter_name == name]
+    
+    @contextlib.contextmanager
+    def timer(self, name, labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, time.perf_counter() - start_time)
+    
+    def summary(self):
+        with self._lock:
+            rows = []
+            for (name, labels), series in sorted(self._series.items()):
+                rows.append({
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": series.count,
+                    "errors": series.errors,
+                    "p50": series.percentile(0.50),
+                    "p95": series.percentile(0.95),
+                    "p99": series.percentile(0.99)
+                })
+            return rows
+    
+    def render_prometheus(self, common_labels=()):
+        def format_labels(labels, extra=()):
+            pairs = list(common_labels) + list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
         
-        @keyframes glow {
-            from {
-                box-shadow: 0 0 10px rgba(57, 255, 20, 0.5);
-            }
-            to {
-                box-shadow: 0 0 20px rgba(57, 255, 20, 0.8);
-            }
-        }
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self._series})
+            for name in names:
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for (series_name, labels), series in sorted(self._series.items()):
+                    if series_name != name:
+                        continue
+                    for bound, bucket_count in zip(self.buckets, series.bucket_counts):
+                        lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {bucket_count}")
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {series.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {series.total:.6f}")
+                    lines.append(f"{name}_count{format_labels(labels)} {series.count}")
+                
+                errors_name = name.replace("_seconds", "_errors_total")
+                lines.append(f"# TYPE {errors_name} counter")
+                for (series_name, labels), series in sorted(self._series.items()):
+                    if series_name == name:
+                        lines.append(f"{errors_name}{format_labels(labels)} {series.errors}")
+            
+            for kind, values in (("gauge", self._gauges), ("counter", self._counters)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (value_name, labels), value in sorted(values.items()):
+                        if value_name == name:
+                            lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+    
+    def export(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(self.render_prometheus([("pid", os.getpid())]))
+        os.replace(temp_path, path)
+    
+    def start_exporter(self, path, interval):
+        # A collector would keep reporting an exited process's last numbers
+        def remove_export():
+            with contextlib.suppress(OSError):
+                os.remove(path)
         
-        .retro-input {
-            background-color: #000000;
-            color: #39FF14;
-            border: 2px solid #39FF14;
-            border-radius: 0px;
-            padding: 10px;
-            font-family: 'VT323', monospace;
-            font-size: 18px;
-        }
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.export(path)
+                except Exception as e:
+                    logger.error(f"Error exporting metrics: {e}")
         
-        .crt-effect {
-            animation: textShadow 1.6s infinite;
-        }
+        threading.Thread(target=run, name="svomo-metrics", daemon=True).start()
+        atexit.register(remove_export)
+
+# Shared metrics registry; its exporter thread starts with it
+@st.cache_resource
+def get_metrics():
+    metrics = MetricsRegistry(METRICS_BUCKETS, METRICS_SAMPLE_WINDOW)
+    metrics.start_exporter(METRICS_EXPORT_PATH.format(pid=os.getpid()), METRICS_EXPORT_INTERVAL)
+    return metrics
+
+# Time every call of a render function as an app step. The step label is a
+# string, or a function returning it at call time. Applied under @st.fragment,
+# fragment-only reruns are timed too.
+def timed_step(step):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_metrics().timer("svomo_step_seconds", {"step": step() if callable(step) else step}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Collapse ids in a TMDB endpoint so e.g. movie/27205 is reported as movie/{id}
+def tmdb_endpoint_template(endpoint):
+    return re.sub(r"/\d+", "/{id}", endpoint)
+
+# Process-wide HTTP client with one pooled keep-alive session per upstream host
+class PooledHttpClient:
+    def __init__(self, pool_sizes, default_pool_size, max_retries, backoff_base, backoff_max, timeout, retry_budget):
+        self.pool_sizes = pool_sizes
+        self.default_pool_size = default_pool_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.retry_budget = retry_budget
+        self._sessions = {}
+        self._retries = {}
+        self._lock = threading.Lock()
+    
+    def _get_session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                pool_size = self.pool_sizes.get(host, self.default_pool_size)
+                logger.info(f"Creating HTTP session for {host} with pool size {pool_size}")
+                # Each session only talks to one host, so a single pool of pool_size connections is enough
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+                self._retries[host] = 0
+            return session
+    
+    def _backoff_delay(self, attempt, response=None):
+        # Honour Retry-After from the upstream when it gives one in seconds
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
         
-        @keyframes textShadow {
-            0% {
-                text-shadow: 0.4389924193300864px 0 1px rgba(0,30,255,0.5), -0.4389924193300864px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            5% {
-                text-shadow: 2.7928974010788217px 0 1px rgba(0,30,255,0.5), -2.7928974010788217px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            10% {
-                text-shadow: 0.02956275843481219px 0 1px rgba(0,30,255,0.5), -0.02956275843481219px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            15% {
-                text-shadow: 0.40218538552878136px 0 1px rgba(0,30,255,0.5), -0.40218538552878136px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            20% {
-                text-shadow: 3.4794037899852017px 0 1px rgba(0,30,255,0.5), -3.4794037899852017px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            25% {
-                text-shadow: 1.6125630401149584px 0 1px rgba(0,30,255,0.5), -1.6125630401149584px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            30% {
-                text-shadow: 0.7015590085143956px 0 1px rgba(0,30,255,0.5), -0.7015590085143956px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            35% {
-                text-shadow: 3.896914047650351px 0 1px rgba(0,30,255,0.5), -3.896914047650351px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            40% {
-                text-shadow: 3.870905614848819px 0 1px rgba(0,30,255,0.5), -3.870905614848819px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            45% {
-                text-shadow: 2.231056963361899px 0 1px rgba(0,30,255,0.5), -2.231056963361899px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            50% {
-                text-shadow: 0.08084290417898504px 0 1px rgba(0,30,255,0.5), -0.08084290417898504px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            55% {
-                text-shadow: 2.3758461067427543px 0 1px rgba(0,30,255,0.5), -2.3758461067427543px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            60% {
-                text-shadow: 2.202193051050636px 0 1px rgba(0,30,255,0.5), -2.202193051050636px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            65% {
-                text-shadow: 2.8638780614874975px 0 1px rgba(0,30,255,0.5), -2.8638780614874975px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            70% {
-                text-shadow: 0.48874025155497314px 0 1px rgba(0,30,255,0.5), -0.48874025155497314px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            75% {
-                text-shadow: 1.8948491305757957px 0 1px rgba(0,30,255,0.5), -1.8948491305757957px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            80% {
-                text-shadow: 0.0833037308038857px 0 1px rgba(0,30,255,0.5), -0.0833037308038857px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            85% {
-                text-shadow: 0.09769827255241735px 0 1px rgba(0,30,255,0.5), -0.09769827255241735px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            90% {
-                text-shadow: 3.443339761481782px 0 1px rgba(0,30,255,0.5), -3.443339761481782px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            95% {
-                text-shadow: 2.1841838852799786px 0 1px rgba(0,30,255,0.5), -2.1841838852799786px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-            100% {
-                text-shadow: 2.6208764473832513px 0 1px rgba(0,30,255,0.5), -2.6208764473832513px 0 1px rgba(255,0,80,0.3), 0 0 3px;
-            }
-        }
+        # Exponential backoff with full jitter so sessions don't retry in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    # retry_gate, if given, is called before every resend and can refuse it; callers
+    # use it to charge each retry to their rate limiter
+    def request(self, method, url, retry_gate=None, **kwargs):
+        host = urlsplit(url).netloc
+        session = self._get_session(host)
+        kwargs.setdefault("timeout", self.timeout)
+        idempotent = method.upper() in HTTP_IDEMPOTENT_METHODS
+        start_time = time.monotonic()
         
-        .retro-background {
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: linear-gradient(45deg, #000000, #1f0033);
-            background-size: 400% 400%;
-            animation: gradient 15s ease infinite;
-            z-index: -1;
-        }
+        attempt = 0
+        while True:
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                # A POST whose response timed out may have been processed, so it isn't resent
+                if not idempotent and isinstance(e, requests.exceptions.ReadTimeout):
+                    raise
+                delay = self._backoff_delay(attempt)
+                if time.monotonic() - start_time + delay > self.retry_budget:
+                    raise
+                if retry_gate and not retry_gate():
+                    raise
+                logger.warning(f"{method} to {host} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            else:
+                if response.status_code not in HTTP_RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self._backoff_delay(attempt, response)
+                if time.monotonic() - start_time + delay > self.retry_budget:
+                    return response
+                if retry_gate and not retry_gate():
+                    return response
+                logger.warning(f"{method} to {host} returned {response.status_code}, retrying in {delay:.2f}s")
+                # Read the body so the connection goes back to the pool
+                response.content
+                response.close()
+            
+            with self._lock:
+                self._retries[host] += 1
+            time.sleep(delay)
+            attempt += 1
+    
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+    
+    def connection_stats(self):
+        with self._lock:
+            sessions = dict(self._sessions)
+            retries = dict(self._retries)
         
-        @keyframes gradient {
-            0% {
-                background-position: 0% 50%;
-            }
-            50% {
-                background-position: 100% 50%;
+        stats = {}
+        for host, session in sessions.items():
+            adapter = session.get_adapter(f"https://{host}")
+            requests_sent = 0
+            connections_opened = 0
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool:
+                    requests_sent += pool.num_requests
+                    connections_opened += pool.num_connections
+            stats[host] = {
+                "requests": requests_sent,
+                "connections": connections_opened,
+                "reused": max(requests_sent - connections_opened, 0),
+                "retries": retries.get(host, 0)
             }
-            100% {
-                background-position: 0% 50%;
+        return stats
+
+# Shared HTTP client, created once per process and reused by every session
+@st.cache_resource
+def get_http_client():
+    return PooledHttpClient(
+        HTTP_POOL_SIZES,
+        HTTP_DEFAULT_POOL_SIZE,
+        HTTP_MAX_RETRIES,
+        HTTP_BACKOFF_BASE,
+        HTTP_BACKOFF_MAX,
+        HTTP_TIMEOUT,
+        HTTP_RETRY_BUDGET
+    )
+
+# Show an error on the page of the session this thread is working for. Background
+# work (question pool refills, speculation, hedge attempts) has no page, so its
+# errors are only logged by the caller.
+def show_error(message):
+    collected = getattr(_request_context, "errors", None)
+    if collected is not None:
+        collected.append(message)
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        st.error(message)
+
+# Priority of upstream calls made by the current thread. Background workers set
+# it around their work; everything else is interactive. A callable priority is
+# read at each call, so work can be promoted while it runs.
+_request_context = threading.local()
+
+def current_request_priority():
+    priority = getattr(_request_context, "priority", PRIORITY_INTERACTIVE)
+    return priority() if callable(priority) else priority
+
+@contextlib.contextmanager
+def request_priority(priority):
+    previous = current_request_priority()
+    _request_context.priority = priority
+    try:
+        yield
+    finally:
+        _request_context.priority = previous
+
+# Collect the messages show_error() displays on this thread, so the result of
+# work shared between sessions can carry its errors to each of them
+@contextlib.contextmanager
+def collect_errors():
+    previous = getattr(_request_context, "errors", None)
+    collected = _request_context.errors = []
+    try:
+        yield collected
+    finally:
+        _request_context.errors = previous
+        if previous is not None:
+            previous.extend(collected)
+
+# Token bucket refilled continuously at `rate` per second, holding at most `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    # Seconds until `amount` tokens are available; a cost larger than the bucket
+    # only has to wait for a full bucket
+    def wait_time(self, amount, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+    
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+# Process-wide rate limiter for one upstream. Requests queue by priority, then
+# arrival order, and the head of the queue goes once every bucket covers its cost.
+class RateLimiter:
+    def __init__(self, name, buckets):
+        self.name = name
+        self.buckets = buckets
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.acquired = {priority: 0 for priority in PRIORITY_NAMES}
+        self.waited = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.timeouts = 0
+        self.max_depth = 0
+    
+    # Wait for a turn; returns the seconds waited, or None if timeout ran out first
+    def acquire(self, priority, costs, timeout):
+        entry = (priority, next(self._sequence))
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            self.max_depth = max(self.max_depth, len(self._waiting))
+            self._publish_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = None
+                    if self._waiting[0] == entry:
+                        delay = max([bucket.wait_time(costs.get(name, 0), now) for name, bucket in self.buckets.items()], default=0.0)
+                        if delay <= 0:
+                            for name, bucket in self.buckets.items():
+                                bucket.take(costs.get(name, 0))
+                            self.acquired[priority] += 1
+                            self.waited[priority] += now - start_time
+                            return now - start_time
+                    
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        return None
+                    self._condition.wait(remaining if delay is None else min(delay, remaining))
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._publish_depth()
+                self._condition.notify_all()
+    
+    # Called with the condition held
+    def _publish_depth(self):
+        depths = {priority: 0 for priority in PRIORITY_NAMES}
+        for priority, _ in self._waiting:
+            depths[priority] += 1
+        metrics = get_metrics()
+        for priority, depth in depths.items():
+            metrics.set_gauge("svomo_rate_limit_queue_depth", {"upstream": self.name, "priority": PRIORITY_NAMES[priority]}, depth)
+    
+    def stats(self):
+        with self._condition:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiting:
+                queued[PRIORITY_NAMES[priority]] += 1
+            acquired = sum(self.acquired.values())
+            return {
+                "queued": queued,
+                "max_depth": self.max_depth,
+                "acquired": {PRIORITY_NAMES[priority]: count for priority, count in self.acquired.items()},
+                "avg_wait": sum(self.waited.values()) / acquired if acquired else 0.0,
+                "timeouts": self.timeouts
             }
-        }
-        
-        .retro-grid {
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: 
-                linear-gradient(rgba(57, 255, 20, 0.1) 1px, transparent 1px),
-                linear-gradient(90deg, rgba(57, 255, 20, 0.1) 1px, transparent 1px);
-            background-size: 20px 20px;
-            z-index: -1;
-            perspective: 1000px;
-            transform-style: preserve-3d;
-            animation: grid-animation 20s infinite linear;
-        }
+
+# Build a limiter from a RATE_LIMITS entry: requests_per_second or
+# requests_per_minute, plus an optional tokens_per_minute budget
+def build_rate_limiter(name, config):
+    buckets = {}
+    if "requests_per_second" in config:
+        rate = float(config["requests_per_second"])
+    else:
+        rate = float(config.get("requests_per_minute", 60)) / 60
+    buckets["requests"] = TokenBucket(rate, float(config.get("burst", max(1.0, rate))))
+    if "tokens_per_minute" in config:
+        token_rate = float(config["tokens_per_minute"]) / 60
+        buckets["tokens"] = TokenBucket(token_rate, float(config.get("token_burst", max(1.0, token_rate))))
+    return RateLimiter(name, buckets)
+
+# Shared rate limiters, one per configured upstream
+@st.cache_resource
+def get_rate_limiters():
+    return {name: build_rate_limiter(name, config) for name, config in RATE_LIMITS.items()}
+
+# Circuit breaker for one upstream. Failed or slow calls count against a rolling
+# window of recent calls; past the failure ratio the breaker opens and calls fail
+# fast. A single background probe then retries the upstream and closes the
+# breaker once it answers.
+class CircuitBreaker:
+    def __init__(self, name, probe, window, min_calls, failure_ratio, slow_call_seconds, open_seconds):
+        self.name = name
+        self.probe = probe
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected = 0
+        self.probes = 0
+    
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            self.rejected += 1
+            return False
+    
+    def record(self, failed, seconds):
+        with self._lock:
+            # Calls that started before the breaker opened don't count
+            if self.state != "closed":
+                return
+            self._outcomes.append(failed or seconds > self.slow_call_seconds)
+            if len(self._outcomes) < self.min_calls:
+                return
+            ratio = sum(self._outcomes) / len(self._outcomes)
+            if ratio < self.failure_ratio:
+                return
+            self.state = "open"
+            self.times_opened += 1
         
-        @keyframes grid-animation {
-            0% {
-                transform: translateZ(0) translateY(0);
+        logger.warning(f"Circuit breaker for {self.name} opened: {ratio:.0%} of recent calls failed or were slow")
+        threading.Thread(target=self._probe_until_closed, name=f"svomo-probe-{self.name}", daemon=True).start()
+    
+    def _probe_until_closed(self):
+        while True:
+            time.sleep(self.open_seconds)
+            with self._lock:
+                self.state = "half_open"
+                self.probes += 1
+            
+            start_time = time.perf_counter()
+            try:
+                self.probe()
+                healthy = time.perf_counter() - start_time <= self.slow_call_seconds
+            except Exception as e:
+                logger.info(f"Probe for {self.name} failed: {e}")
+                healthy = False
+            
+            with self._lock:
+                if healthy:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                else:
+                    self.state = "open"
+            if healthy:
+                logger.info(f"Circuit breaker for {self.name} closed after a successful probe")
+                return
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failure_ratio": sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "probes": self.probes
             }
-            100% {
-                transform: translateZ(0) translateY(20px);
+
+# Cheap requests used to check whether an upstream has recovered
+def probe_tmdb():
+    get_http_client().get(f"{TMDB_BASE_URL}/configuration", params={"api_key": TMDB_API_KEY}).raise_for_status()
+
+def probe_gemini():
+    # Model metadata, which costs no tokens
+    model_url = GEMINI_BASE_URL.rsplit(":", 1)[0]
+    get_http_client().get(model_url, params={"key": GEMINI_API_KEY}).raise_for_status()
+
+# Shared circuit breakers, one per configured upstream
+@st.cache_resource
+def get_circuit_breakers():
+    probes = {"tmdb": probe_tmdb, "gemini": probe_gemini}
+    return {name: CircuitBreaker(name, probes[name], **config) for name, config in CIRCUIT_BREAKERS.items()}
+
+# Errors that mean the upstream itself is unhealthy: no connection, a timeout,
+# a broken response body, or a 5xx. Only these, plus slow calls, count against
+# a circuit breaker; 4xx responses, bad payloads and callers giving up don't.
+def is_upstream_error(error):
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code >= 500
+
+# Rough Gemini token cost of a prompt and its response, for the tokens_per_minute
+# budget; a route's output cap bounds the response part
+def estimate_gemini_tokens(prompt, max_output_tokens=None):
+    return len(prompt) // 4 + min(max_output_tokens or GEMINI_RESPONSE_TOKEN_ESTIMATE, GEMINI_RESPONSE_TOKEN_ESTIMATE)
+
+# Resolve the Gemini route for a call purpose: model, endpoint URLs, timeout, and
+# the generationConfig with the caller's settings layered over the route's
+def get_gemini_route(purpose, generation_config=None):
+    config = GEMINI_ROUTES.get(purpose, {})
+    models_url, default_model = GEMINI_BASE_URL.rsplit(":", 1)[0].rsplit("/", 1)
+    model = config.get("model", default_model)
+    
+    route_config = {}
+    if "max_output_tokens" in config:
+        route_config["maxOutputTokens"] = int(config["max_output_tokens"])
+    if "temperature" in config:
+        route_config["temperature"] = float(config["temperature"])
+    route_config.update(generation_config or {})
+    if GEMINI_DETERMINISTIC:
+        route_config["temperature"] = 0
+    
+    return {
+        "purpose": purpose,
+        "model": model,
+        "url": f"{models_url}/{model}:generateContent",
+        "stream_url": f"{models_url}/{model}:streamGenerateContent",
+        "timeout": config.get("timeout", HTTP_TIMEOUT),
+        "generation_config": route_config,
+    }
+
+# Log a response cut off at its output cap. For JSON purposes the answer won't
+# parse, so that is an error pointing at the route's cap.
+def log_gemini_truncation(route, max_output_tokens):
+    limit = f"its {max_output_tokens} token cap" if max_output_tokens else "the model's output limit"
+    if route["purpose"] in GEMINI_JSON_PURPOSES:
+        logger.error(f"Gemini {route['purpose']} response hit {limit} and won't parse; raise or remove max_output_tokens for this route")
+    else:
+        logger.warning(f"Gemini {route['purpose']} response hit {limit}")
+
+# Record a call's token usage from the response's usageMetadata, estimating
+# from the text lengths when the response doesn't report it
+def record_gemini_usage(route, usage, prompt, output_length):
+    labels = {"purpose": route["purpose"], "model": route["model"]}
+    metrics = get_metrics()
+    metrics.increment("svomo_gemini_tokens_total", dict(labels, direction="prompt"), usage.get("promptTokenCount", len(prompt) // 4))
+    metrics.increment("svomo_gemini_tokens_total", dict(labels, direction="output"), usage.get("candidatesTokenCount", output_length // 4))
+
+# Wait for a turn under the upstream's rate limit at the current thread's
+# priority. Returns False if the wait timed out.
+def wait_for_rate_limit(upstream, tokens=0):
+    limiter = get_rate_limiters().get(upstream)
+    if limiter is None:
+        return True
+    
+    priority = current_request_priority()
+    waited = limiter.acquire(priority, {"requests": 1, "tokens": tokens}, RATE_LIMIT_MAX_WAIT)
+    labels = {"upstream": upstream, "priority": PRIORITY_NAMES[priority]}
+    if waited is None:
+        get_metrics().observe("svomo_rate_limit_wait_seconds", labels, RATE_LIMIT_MAX_WAIT, error=True)
+        logger.error(f"Gave up waiting for the {upstream} rate limit after {RATE_LIMIT_MAX_WAIT}s")
+        return False
+    
+    get_metrics().observe("svomo_rate_limit_wait_seconds", labels, waited)
+    if waited >= 1:
+        logger.info(f"Waited {waited:.1f}s for the {upstream} rate limit ({PRIORITY_NAMES[priority]})")
+    return True
+
+# Function to call Gemini API. purpose picks the route in GEMINI_ROUTES (model,
+# output cap, timeout) and labels the call's metrics; generation_config is layered
+# over the route's generationConfig (e.g. responseMimeType/responseSchema).
+# With GEMINI_DETERMINISTIC, concurrent identical calls share one request.
+# While Gemini's circuit breaker is open, a prompt answered before gets its last
+# good response and anything else fails fast.
+def call_gemini_api(prompt, generation_config=None, purpose="other"):
+    route = get_gemini_route(purpose, generation_config)
+    key = hashlib.sha256(json.dumps([route["url"], prompt, route["generation_config"]], sort_keys=True).encode("utf-8")).hexdigest()
+    responses = get_gemini_response_cache()
+    
+    if not get_circuit_breakers()["gemini"].allow():
+        stale = responses.get_stale(key)
+        if stale is not None:
+            logger.info(f"Gemini unavailable, serving last good response for {purpose}")
+            return stale.decode("utf-8")
+        error_msg = "Gemini is unavailable right now, please try again shortly"
+        logger.warning(error_msg)
+        show_error(error_msg)
+        return None
+    
+    if GEMINI_DETERMINISTIC:
+        text = get_single_flights()["gemini"].do(key, lambda: send_gemini(prompt, route))
+    else:
+        text = send_gemini(prompt, route)
+    if text is not None and (purpose in GEMINI_STALE_PURPOSES or route["generation_config"].get("temperature") == 0):
+        # Stored already expired: only ever read back as a stale fallback
+        responses.set(key, text.encode("utf-8"), 0)
+    return text
+
+# Process-wide hedging counters, plus the budget that caps how many hedges are sent.
+# Every call earns HEDGE_BUDGET of a hedge (up to a small reserve) and a hedge spends one.
+class HedgeStats:
+    def __init__(self, budget):
+        self.budget = budget
+        self._credit = 0.0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.extra_tokens = 0
+    
+    def record_call(self):
+        with self._lock:
+            self.calls += 1
+            self._credit = min(self._credit + self.budget, 10.0)
+    
+    def try_hedge(self, tokens):
+        with self._lock:
+            if self._credit < 1:
+                self.budget_denied += 1
+                return False
+            self._credit -= 1
+            self.hedged += 1
+            self.extra_tokens += tokens
+            return True
+    
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "win_rate": self.hedge_wins / self.hedged if self.hedged else 0.0,
+                "budget_denied": self.budget_denied,
+                "extra_tokens": self.extra_tokens
             }
-        }
-        
-        .loading-animation {
-            width: 50px;
-            height: 50px;
-            border: 5px solid rgba(57, 255, 20, 0.3);
-            border-radius: 50%;
-            border-top-color: #39FF14;
-            animation: spin 1s ease-in-out infinite;
-            margin: 20px auto;
-            box-shadow: 0 0 15px #39FF14;
-        }
-        
-        @keyframes spin {
-            to { transform: rotate(360deg); }
-        }
-        
-        .credits {
-            text-align: center;
-            color: #39FF14;
-            font-family: 'VT323', monospace;
-            font-size: 16px;
-            margin-top: 20px;
-            padding: 5px;
-            border-top: 1px solid #39FF14;
-            border-bottom: 1px solid #39FF14;
-            background-color: rgba(0, 0, 0, 0.5);
-        }
-        
-        /* Scanline effect */
-        .scanlines {
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: repeating-linear-gradient(
-                to bottom,
-                rgba(0, 0, 0, 0) 0px,
-                rgba(0, 0, 0, 0) 1px,
-                rgba(0, 0, 0, 0.1) 1px,
-                rgba(0, 0, 0, 0.1) 2px
-            );
-            pointer-events: none;
-            z-index: 10;
-        }
-    </style>
-    <div class="retro-background"></div>
-    <div class="retro-grid"></div>
-    <div class="scanlines"></div>
-    """, unsafe_allow_html=True)
 
-# Display loading animation
-def loading_animation():
-    with st.spinner():
-        st.markdown('<div class="loading-animation"></div>', unsafe_allow_html=True)
-        time.sleep(2)
+@st.cache_resource
+def get_hedge_stats():
+    return HedgeStats(HEDGE_BUDGET)
+
+@st.cache_resource
+def get_hedge_executor():
+    return ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="svomo-hedge")
+
+# Send a Gemini request, hedged with a duplicate if it is still running after the
+# route's observed p90. The first successful answer wins; a loser that hasn't
+# started is cancelled, and one already in flight has its answer discarded.
+def send_gemini(prompt, route):
+    if not GEMINI_HEDGING:
+        return request_gemini(prompt, route)
+    
+    purpose = route["purpose"]
+    hedge_stats = get_hedge_stats()
+    hedge_stats.record_call()
+    delay = get_metrics().percentile("svomo_gemini_request_seconds", {"purpose": purpose, "model": route["model"]}, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    if delay is None:
+        # Not enough history for this route to know what slow looks like
+        return request_gemini(prompt, route)
+    
+    priority = current_request_priority()
+    cancelled = threading.Event()
+    
+    # Attempts run on the hedge pool, away from the session's page, so each one
+    # collects its errors and they are reported once from here
+    def attempt():
+        with request_priority(priority), collect_errors() as errors:
+            return request_gemini(prompt, route, cancelled), errors
+    
+    executor = get_hedge_executor()
+    attempts = [executor.submit(attempt)]
+    done, _ = wait(attempts, timeout=max(delay, HEDGE_MIN_DELAY))
+    if not done and hedge_stats.try_hedge(estimate_gemini_tokens(prompt, route["generation_config"].get("maxOutputTokens"))):
+        logger.info(f"Hedging Gemini {purpose} call after {max(delay, HEDGE_MIN_DELAY):.2f}s")
+        attempts.append(executor.submit(attempt))
+    
+    text = None
+    errors = []
+    pending = set(attempts)
+    while pending and text is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            attempt_text, attempt_errors = future.result()
+            if text is None and attempt_text is not None:
+                text = attempt_text
+                if len(attempts) > 1 and future is attempts[1]:
+                    hedge_stats.record_win()
+            errors.extend(message for message in attempt_errors if message not in errors)
+    
+    # The losing attempt sends no more retries and drops its response unread
+    cancelled.set()
+    for future in pending:
+        future.cancel()
+    
+    if text is None:
+        for message in errors or [f"Gemini API call failed for {purpose}"]:
+            show_error(message)
+    return text
 
-# Function to call Gemini API
-def call_gemini_api(prompt):
-    logger.info(f"Calling Gemini API with prompt length: {len(prompt)}")
+# Send one generateContent request along a route and return the response text,
+# or None on failure. Once `cancelled` is set (another hedge attempt answered
+# first) the request isn't retried and its response is closed unread.
+def request_gemini(prompt, route, cancelled=None):
+    logger.info(f"Calling Gemini API ({route['model']}) with prompt length: {len(prompt)}")
     
     if not GEMINI_API_KEY:
         error_msg = "Missing Gemini API key in secrets.toml"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return None
     
     headers = {
@@ -307,97 +1334,710 @@ def call_gemini_api(prompt):
             "parts": [{"text": prompt}]
         }]
     }
+    if route["generation_config"]:
+        data["generationConfig"] = route["generation_config"]
     
-    url = f"{GEMINI_BASE_URL}?key={GEMINI_API_KEY}"
+    url = f"{route['url']}?key={GEMINI_API_KEY}"
+    max_output_tokens = route["generation_config"].get("maxOutputTokens")
     
+    if not wait_for_rate_limit("gemini", estimate_gemini_tokens(prompt, max_output_tokens)):
+        error_msg = "Gemini API is busy, please try again in a moment"
+        show_error(error_msg)
+        return None
+    if cancelled is not None and cancelled.is_set():
+        return None
+    
+    start_time = time.perf_counter()
+    failed = True
+    # Whether the upstream looked unhealthy; None leaves the breaker alone
+    upstream_failed = None
+    response = None
     try:
-        response = requests.post(url, headers=headers, json=data)
+        # Streamed so a cancelled attempt can close the connection without reading the body
+        response = get_http_client().post(
+            url,
+            headers=headers,
+            json=data,
+            stream=True,
+            timeout=route["timeout"],
+            retry_gate=lambda: not (cancelled is not None and cancelled.is_set()) and wait_for_rate_limit("gemini", estimate_gemini_tokens(prompt, max_output_tokens))
+        )
+        if cancelled is not None and cancelled.is_set():
+            failed = False
+            logger.info(f"Dropping Gemini {route['purpose']} response, another attempt answered first")
+            return None
         response.raise_for_status()
+        upstream_failed = False
         result = response.json()
+        duration_ms = round((time.perf_counter() - start_time) * 1000, 1)
         
         # Log success but not the full response content (could be large)
-        logger.info(f"Gemini API call successful, response length: {len(str(result))}")
+        logger.info(f"Gemini API call successful, response length: {len(str(result))}", extra={"duration_ms": duration_ms, "purpose": route["purpose"]})
         
         # Validate response structure
         if "candidates" not in result or not result["candidates"]:
             error_msg = "Gemini API returned empty candidates"
             logger.error(error_msg)
-            st.error(error_msg)
+            show_error(error_msg)
             return None
             
         if "content" not in result["candidates"][0] or "parts" not in result["candidates"][0]["content"]:
             error_msg = "Unexpected Gemini API response structure"
             logger.error(error_msg)
-            st.error(error_msg)
+            show_error(error_msg)
             return None
+        
+        text = result["candidates"][0]["content"]["parts"][0]["text"]
+        record_gemini_usage(route, result.get("usageMetadata") or {}, prompt, len(text))
+        if result["candidates"][0].get("finishReason") == "MAX_TOKENS":
+            log_gemini_truncation(route, max_output_tokens)
             
-        return result["candidates"][0]["content"]["parts"][0]["text"]
+        failed = False
+        return text
     except requests.exceptions.ConnectionError as e:
+        upstream_failed = True
         error_msg = f"Connection error calling Gemini API: {e}"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return None
     except requests.exceptions.RequestException as e:
+        upstream_failed = is_upstream_error(e)
         error_msg = f"Request error calling Gemini API: {e}"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return None
     except Exception as e:
         error_msg = f"Error calling Gemini API: {e}"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return None
+    finally:
+        if response is not None:
+            response.close()
+        elapsed = time.perf_counter() - start_time
+        get_metrics().observe("svomo_gemini_request_seconds", {"purpose": route["purpose"], "model": route["model"]}, elapsed, error=failed)
+        if upstream_failed is not None:
+            get_circuit_breakers()["gemini"].record(upstream_failed, elapsed)
+
+# Function to call Gemini's streaming endpoint (server-sent events).
+# Yields text chunks as they arrive.
+def stream_gemini_api(prompt, generation_config=None, purpose="other"):
+    route = get_gemini_route(purpose, generation_config)
+    logger.info(f"Streaming Gemini API ({route['model']}) with prompt length: {len(prompt)}")
+    
+    if not GEMINI_API_KEY:
+        error_msg = "Missing Gemini API key in secrets.toml"
+        logger.error(error_msg)
+        show_error(error_msg)
+        return
+    
+    headers = {
+        "Content-Type": "application/json"
+    }
+    
+    data = {
+        "contents": [{
+            "parts": [{"text": prompt}]
+        }]
+    }
+    if route["generation_config"]:
+        data["generationConfig"] = route["generation_config"]
+    
+    url = f"{route['stream_url']}?alt=sse&key={GEMINI_API_KEY}"
+    max_output_tokens = route["generation_config"].get("maxOutputTokens")
+    
+    if not get_circuit_breakers()["gemini"].allow():
+        error_msg = "Gemini is unavailable right now, please try again shortly"
+        logger.warning(error_msg)
+        show_error(error_msg)
+        return
+    
+    if not wait_for_rate_limit("gemini", estimate_gemini_tokens(prompt, max_output_tokens)):
+        error_msg = "Gemini API is busy, please try again in a moment"
+        show_error(error_msg)
+        return
+    
+    start_time = time.perf_counter()
+    response_seconds = None
+    failed = True
+    # Whether the upstream looked unhealthy; None leaves the breaker alone
+    upstream_failed = None
+    try:
+        response = get_http_client().post(
+            url,
+            headers=headers,
+            json=data,
+            stream=True,
+            timeout=route["timeout"],
+            retry_gate=lambda: wait_for_rate_limit("gemini", estimate_gemini_tokens(prompt, max_output_tokens))
+        )
+        response.raise_for_status()
+        # Judge slowness by time to the response, not how long the consumer reads for
+        upstream_failed = False
+        response_seconds = time.perf_counter() - start_time
+        
+        streamed_length = 0
+        usage = {}
+        finish_reason = None
+        # Server-sent events are always UTF-8, but without a charset in the
+        # content type requests would decode them as ISO-8859-1
+        response.encoding = "utf-8"
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                
+                event = json.loads(line[len("data:"):].strip())
+                # Each event carries the running totals; the last one is final
+                usage = event.get("usageMetadata") or usage
+                candidates = event.get("candidates") or []
+                if not candidates:
+                    continue
+                finish_reason = candidates[0].get("finishReason") or finish_reason
+                
+                for part in candidates[0].get("content", {}).get("parts", []):
+                    text = part.get("text")
+                    if text:
+                        streamed_length += len(text)
+                        yield text
+        
+        failed = False
+        logger.info(f"Gemini API stream finished, response length: {streamed_length}")
+        record_gemini_usage(route, usage, prompt, streamed_length)
+        if finish_reason == "MAX_TOKENS":
+            log_gemini_truncation(route, max_output_tokens)
+    except GeneratorExit:
+        # The consumer stopped reading early; that isn't an upstream failure
+        failed = False
+        logger.info(f"Gemini API stream closed by its consumer after {streamed_length} characters")
+        raise
+    except requests.exceptions.ConnectionError as e:
+        upstream_failed = True
+        error_msg = f"Connection error streaming Gemini API: {e}"
+        logger.error(error_msg)
+        show_error(error_msg)
+    except requests.exceptions.RequestException as e:
+        upstream_failed = is_upstream_error(e)
+        error_msg = f"Request error streaming Gemini API: {e}"
+        logger.error(error_msg)
+        show_error(error_msg)
+    except Exception as e:
+        error_msg = f"Error streaming Gemini API: {e}"
+        logger.error(error_msg)
+        show_error(error_msg)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        get_metrics().observe("svomo_gemini_request_seconds", {"purpose": f"{purpose}_stream", "model": route["model"]}, elapsed, error=failed)
+        if upstream_failed is not None:
+            get_circuit_breakers()["gemini"].record(upstream_failed, response_seconds if response_seconds is not None else elapsed)
+
+# Incremental parser for a streamed JSON array of objects. feed() returns every
+# top-level object completed by the new text; anything before the opening '['
+# is ignored.
+class IncrementalJsonArrayParser:
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._item_start = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.finished = False
+    
+    def feed(self, text):
+        items = []
+        if self.finished:
+            return items
+        
+        self._buffer += text
+        while self._pos < len(self._buffer):
+            ch = self._buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif not self._started:
+                if ch == "[":
+                    self._started = True
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0:
+                    self._item_start = self._pos
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the top-level array
+                    self.finished = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    item_text = self._buffer[self._item_start:self._pos + 1]
+                    try:
+                        items.append(json.loads(item_text))
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Skipping malformed streamed JSON item: {e}")
+            self._pos += 1
+        
+        # Drop everything that has already been consumed
+        if self._depth == 0:
+            self._buffer = ""
+            self._pos = 0
+        elif self._item_start > 0:
+            self._buffer = self._buffer[self._item_start:]
+            self._pos -= self._item_start
+            self._item_start = 0
+        
+        return items
+
+# Coalesces concurrent identical calls: the first caller for a key runs the
+# call, and callers arriving while it is in flight wait for and share its result.
+# Callers only wait on a call running at their own rate-limit priority or a more
+# urgent one, and errors the call showed its own session are shown to each
+# waiting session too.
+class SingleFlight:
+    # Result of a call whose leader was interrupted by a non-error exception
+    # (e.g. its script run being stopped or rerun); waiting callers try again
+    _RETRY = object()
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.collapsed = 0
+        self.retried = 0
+    
+    def do(self, key, function):
+        priority = current_request_priority()
+        while True:
+            with self._lock:
+                call = next((self._calls[(key, level)] for level in range(priority + 1) if (key, level) in self._calls), None)
+                leader = call is None
+                if leader:
+                    call = self._calls[(key, priority)] = Future()
+                    self.leaders += 1
+                else:
+                    self.collapsed += 1
+            if leader:
+                return self._lead(key, priority, call, function)
+            
+            result, errors = call.result()
+            if result is self._RETRY:
+                with self._lock:
+                    self.retried += 1
+                continue
+            for message in errors:
+                show_error(message)
+            return result
+    
+    def _lead(self, key, priority, call, function):
+        try:
+            with collect_errors() as errors:
+                result = function()
+            call.set_result((result, errors))
+            return result
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        except BaseException:
+            call.set_result((self._RETRY, []))
+            raise
+        finally:
+            with self._lock:
+                del self._calls[(key, priority)]
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "collapsed": self.collapsed,
+                "retried": self.retried,
+                "in_flight": len(self._calls)
+            }
+
+# Shared coalescing groups, one per upstream
+@st.cache_resource
+def get_single_flights():
+    return {"tmdb": SingleFlight(), "gemini": SingleFlight()}
+
+# Bounded in-memory cache with per-entry TTL and LRU eviction by byte size.
+# Expired entries are kept as stale fallbacks for at most max_stale seconds.
+class TtlLruCache:
+    def __init__(self, max_bytes, max_stale=STALE_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.max_stale = max_stale
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._swept_at = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+    
+    def _remove(self, key):
+        payload, _ = self._entries.pop(key)
+        self._bytes -= len(payload)
+    
+    # record=False looks up without counting towards hits and misses
+    def get(self, key, record=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += record
+                return None
+            
+            # Expired entries stay until evicted or swept, as stale fallbacks
+            payload, expires_at = entry
+            if expires_at <= time.time():
+                self.expirations += 1
+                self.misses += record
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += record
+            return payload
+    
+    # Drop entries that expired more than max_stale seconds ago. Called with the
+    # lock held; scans at most once per STALE_SWEEP_INTERVAL.
+    def _sweep(self, now):
+        if now - self._swept_at < STALE_SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        for key in [key for key, (_, expires_at) in self._entries.items() if expires_at + self.max_stale <= now]:
+            self._remove(key)
+            self.evictions += 1
+    
+    # Return a payload even if expired, as long as it expired less than max_stale seconds ago
+    def get_stale(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] + self.max_stale <= time.time():
+                return None
+            self.stale_hits += 1
+            return entry[0]
+    
+    def set(self, key, payload, ttl):
+        # Entries larger than the whole budget would just evict everything else
+        if len(payload) > self.max_bytes:
+            return
+        
+        with self._lock:
+            now = time.time()
+            self._sweep(now)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, now + ttl)
+            self._bytes += len(payload)
+            
+            while self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "stale_hits": self.stale_hits
+            }
+
+# Shared TMDB response cache, used by every session in the process
+@st.cache_resource
+def get_tmdb_cache():
+    return TtlLruCache(TMDB_CACHE_MAX_BYTES)
+
+# Last good Gemini response per request, served while Gemini is unavailable
+@st.cache_resource
+def get_gemini_response_cache():
+    return TtlLruCache(GEMINI_STALE_MAX_BYTES)
+
+# Pick the cache TTL for a TMDB endpoint by longest matching prefix
+def get_tmdb_cache_ttl(endpoint):
+    best_prefix = ""
+    ttl = TMDB_CACHE_DEFAULT_TTL
+    for prefix, prefix_ttl in TMDB_CACHE_TTLS.items():
+        if endpoint.startswith(prefix) and len(prefix) > len(best_prefix):
+            best_prefix = prefix
+            ttl = prefix_ttl
+    return ttl
 
-# Function to call TMDB API
+# Build a cache key from the endpoint and normalized params (the API key is not part of it)
+def make_tmdb_cache_key(endpoint, params):
+    normalized = []
+    for name, value in sorted(params.items()):
+        if name == "api_key" or value is None:
+            continue
+        value = str(value).strip()
+        # TMDB search is case-insensitive, so "Inception" and "inception " share an entry
+        if name == "query":
+            value = " ".join(value.lower().split())
+        normalized.append(f"{name}={value}")
+    return f"{endpoint}?{'&'.join(normalized)}"
+
+# Function to call TMDB API. Concurrent identical requests share one upstream call.
 def call_tmdb_api(endpoint, params=None):
     if not TMDB_API_KEY:
         error_msg = "Missing TMDB API key in secrets.toml"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return None
     
     if params is None:
         params = {}
     
+    # Serve from the shared cache when possible; payloads are stored as JSON bytes
+    # so each caller gets its own copy to modify
+    cache = get_tmdb_cache()
+    cache_key = make_tmdb_cache_key(endpoint, params)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"TMDB cache hit: {endpoint}", extra={"sample": True})
+        return json.loads(cached)
+    
+    payload = get_single_flights()["tmdb"].do(cache_key, lambda: fetch_tmdb_payload(endpoint, dict(params), cache_key))
+    return json.loads(payload) if payload is not None else None
+
+# Fetch a TMDB response and cache it; returns the JSON payload bytes or None
+def fetch_tmdb_payload(endpoint, params, cache_key):
+    cache = get_tmdb_cache()
+    # A call that finished just before this one became the leader has cached its result
+    cached = cache.get(cache_key, record=False)
+    if cached is not None:
+        return cached
+    
+    # While TMDB's circuit breaker is open, serve the last good response if there is one
+    if not get_circuit_breakers()["tmdb"].allow():
+        stale = cache.get_stale(cache_key)
+        if stale is not None:
+            logger.info(f"TMDB unavailable, serving stale response for {endpoint}")
+            return stale
+        error_msg = f"TMDB is unavailable right now, skipped {endpoint}"
+        logger.warning(error_msg)
+        show_error(error_msg)
+        return None
+    
     params["api_key"] = TMDB_API_KEY
     
     url = f"{TMDB_BASE_URL}/{endpoint}"
-    logger.info(f"Calling TMDB API: {endpoint}")
+    logger.info(f"Calling TMDB API: {endpoint}", extra={"sample": True})
     
+    if not wait_for_rate_limit("tmdb"):
+        error_msg = f"TMDB API is busy, skipped {endpoint}"
+        show_error(error_msg)
+        return None
+    
+    start_time = time.perf_counter()
+    failed = True
+    # Whether the upstream looked unhealthy; None leaves the breaker alone
+    upstream_failed = None
     try:
-        response = requests.get(url, params=params)
+        response = get_http_client().get(url, params=params, retry_gate=lambda: wait_for_rate_limit("tmdb"))
         response.raise_for_status()
-        data = response.json()
-        logger.info(f"TMDB API call successful: {endpoint}")
-        return data
+        upstream_failed = False
+        payload = json.dumps(response.json()).encode("utf-8")
+        duration_ms = round((time.perf_counter() - start_time) * 1000, 1)
+        logger.info(f"TMDB API call successful: {endpoint}", extra={"endpoint": endpoint, "duration_ms": duration_ms})
+        cache.set(cache_key, payload, get_tmdb_cache_ttl(endpoint))
+        failed = False
+        return payload
     except requests.exceptions.ConnectionError as e:
+        upstream_failed = True
         error_msg = f"Connection error calling TMDB API {endpoint}: {e}"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return None
     except requests.exceptions.HTTPError as e:
+        upstream_failed = is_upstream_error(e)
         error_msg = f"HTTP error calling TMDB API {endpoint}: {e}"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return None
     except Exception as e:
+        # e.g. a read timeout, which is neither a ConnectionError nor an HTTPError
+        if is_upstream_error(e):
+            upstream_failed = True
         error_msg = f"Error calling TMDB API {endpoint}: {e}"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return None
+    finally:
+        elapsed = time.perf_counter() - start_time
+        get_metrics().observe("svomo_tmdb_request_seconds", {"endpoint": tmdb_endpoint_template(endpoint)}, elapsed, error=failed)
+        if upstream_failed is not None:
+            get_circuit_breakers()["tmdb"].record(upstream_failed, elapsed)
+
+# Pick the smallest TMDB poster size that still covers the display width
+def pick_poster_size(poster_sizes, display_width):
+    widths = sorted(int(size[1:]) for size in poster_sizes if size.startswith("w") and size[1:].isdigit())
+    for width in widths:
+        if width >= display_width:
+            return f"w{width}"
+    if "original" in poster_sizes:
+        return "original"
+    return f"w{widths[-1]}" if widths else "w500"
 
-# Function to get movie poster
-def get_movie_poster(poster_path, size="w500"):
+# Function to get movie poster. Without an explicit size, the smallest size
+# covering POSTER_DISPLAY_WIDTH is used.
+def get_movie_poster(poster_path, size=None):
     if not poster_path:
         return DEFAULT_IMAGE_URL
     
     config = call_tmdb_api("configuration")
     if config and "images" in config:
         base_url = config["images"]["secure_base_url"]
+        if not size:
+            size = pick_poster_size(config["images"].get("poster_sizes", []), POSTER_DISPLAY_WIDTH)
         return f"{base_url}{size}{poster_path}"
     
     return DEFAULT_IMAGE_URL
 
+# Disk cache of posters fetched once and re-encoded to compact thumbnails.
+# Oldest files (by last use) are removed once the directory exceeds max_bytes.
+# Concurrent misses for the same poster share one download.
+class PosterCache:
+    def __init__(self, directory, max_bytes, width):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.width = width
+        self.format = "WEBP" if features.check("webp") else "JPEG"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+    
+    def _path(self, url):
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.{self.format.lower()}")
+    
+    def _reencode(self, content):
+        image = Image.open(io.BytesIO(content))
+        image = image.convert("RGB")
+        image.thumbnail((self.width, self.width * 3))
+        output = io.BytesIO()
+        if self.format == "WEBP":
+            image.save(output, "WEBP", quality=80, method=4)
+        else:
+            image.save(output, "JPEG", quality=85, optimize=True, progressive=True)
+        return output.getvalue()
+    
+    def ensure(self, url):
+        path = self._path(url)
+        if os.path.exists(path):
+            # Record the access so eviction removes the least recently used posters first
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return path
+        
+        with self._lock:
+            self.misses += 1
+        return self._flights.do(url, lambda: self._fetch(url, path))
+    
+    def _fetch(self, url, path):
+        response = get_http_client().get(url)
+        response.raise_for_status()
+        data = self._reencode(response.content)
+        
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as poster_file:
+            poster_file.write(data)
+        # Another process sharing the directory may have written it meanwhile
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_path, path)
+        
+        with self._lock:
+            self._bytes += len(data) - replaced
+            over_budget = self._bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+        
+        return path
+    
+    def get(self, url):
+        with open(self.ensure(url), "rb") as poster_file:
+            return poster_file.read()
+    
+    def _evict(self):
+        with self._lock:
+            entries = sorted(
+                (entry for entry in os.scandir(self.directory) if entry.is_file()),
+                key=lambda entry: entry.stat().st_mtime
+            )
+            total = sum(entry.stat().st_size for entry in entries)
+            # Trim to 90% of the budget so we don't evict on every new poster
+            target = self.max_bytes * 0.9
+            removed = 0
+            for entry in entries:
+                if total <= target:
+                    break
+                size = entry.stat().st_size
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self._bytes = total
+        logger.info(f"Evicted {removed} cached posters")
+    
+    def stats(self):
+        with self._lock:
+            return {"bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+# Shared poster cache for every session in the process
+@st.cache_resource
+def get_poster_cache():
+    return PosterCache(POSTER_CACHE_DIR, POSTER_CACHE_MAX_BYTES, POSTER_DISPLAY_WIDTH)
+
+# Function to get the URL a card should load its poster from: the cached,
+# right-sized copy under static/, or the remote URL if caching fails
+def get_poster_src(poster_url):
+    try:
+        path = get_poster_cache().ensure(poster_url)
+        return f"{STATIC_URL}/posters/{os.path.basename(path)}"
+    except Exception as e:
+        logger.warning(f"Error caching poster {poster_url}: {e}")
+        return poster_url
+
+# Function to make a tiny blurred placeholder for a poster, inlined as a
+# base64 data URI (a few hundred bytes)
+def get_poster_placeholder(poster_url):
+    try:
+        image = Image.open(io.BytesIO(get_poster_cache().get(poster_url)))
+        image = image.convert("RGB")
+        image.thumbnail((POSTER_PLACEHOLDER_WIDTH, POSTER_PLACEHOLDER_WIDTH * 3))
+        image = image.filter(ImageFilter.GaussianBlur(1))
+        output = io.BytesIO()
+        if features.check("webp"):
+            image.save(output, "WEBP", quality=40)
+            mime_type = "image/webp"
+        else:
+            image.save(output, "JPEG", quality=40, optimize=True)
+            mime_type = "image/jpeg"
+        return f"data:{mime_type};base64," + base64.b64encode(output.getvalue()).decode("ascii")
+    except Exception as e:
+        logger.warning(f"Error creating poster placeholder for {poster_url}: {e}")
+        return None
+
 # Function to generate questions based on user persona
 def generate_questions(persona):
     logger.info(f"Generating questions for persona: {persona}")
@@ -430,7 +2070,7 @@ def generate_questions(persona):
     Make sure your response is properly formatted and valid JSON.
     """
     
-    response = call_gemini_api(prompt)
+    response = call_gemini_api(prompt, purpose="questions")
     if not response:
         logger.error("Failed to get response from Gemini API for questions")
         return []
@@ -446,34 +2086,11 @@ def generate_questions(persona):
         if json_start == -1 or json_end == 0:
             error_msg = "Could not find JSON array in Gemini response"
             logger.error(error_msg)
-            st.error(error_msg)
+            show_error(error_msg)
             
             # Fallback to default questions if JSON extraction fails
-            default_questions = [
-                {
-                    "question": "Are you watching alone or with someone?",
-                    "options": ["Alone", "With friends", "With family", "With a partner"]
-                },
-                {
-                    "question": "What's your current mood?",
-                    "options": ["Happy", "Relaxed", "Sad", "Excited", "Thoughtful"]
-                },
-                {
-                    "question": "Do you prefer older classics or newer releases?",
-                    "options": ["Classics", "Recent releases", "Both"]
-                },
-                {
-                    "question": "How much time do you have?",
-                    "options": ["Under 2 hours", "2-3 hours", "I have all day"]
-                },
-                {
-                    "question": "What kind of ending do you prefer?",
-                    "options": ["Happy", "Thought-provoking", "Doesn't matter"]
-                }
-            ]
-            
             logger.info("Using default questions instead")
-            return default_questions
+            return [dict(q, options=list(q["options"])) for q in DEFAULT_QUESTIONS]
         
         json_str = response[json_start:json_end]
         logger.info(f"Extracted JSON string length: {len(json_str)}")
@@ -491,19 +2108,291 @@ def generate_questions(persona):
         
         return questions
     except json.JSONDecodeError as e:
-        error_msg = f"JSON decode error: {e}"
+        error_msg = f"JSON decode error: {e}"
+        logger.error(error_msg)
+        logger.error(f"Failed JSON string: {response[:100]}...")
+        show_error(error_msg)
+        return []
+    except Exception as e:
+        error_msg = f"Error parsing questions: {e}"
+        logger.error(error_msg)
+        show_error(error_msg)
+        return []
+
+# Check that a generated question set is complete enough to serve from the pool
+def is_valid_question_set(questions):
+    if not isinstance(questions, list) or len(questions) < QUESTION_SET_MIN_LENGTH:
+        return False
+    # The hard-coded fallback is not worth pooling; it is served on demand anyway
+    if questions == DEFAULT_QUESTIONS:
+        return False
+    for q in questions:
+        if not isinstance(q, dict) or not q.get("question"):
+            return False
+        if not isinstance(q.get("options"), list) or not q["options"]:
+            return False
+    return True
+
+# One question and its options. Question sets are tuples of these and are never
+# modified, so sessions served the same pooled set share it.
+class Question:
+    __slots__ = ("text", "options")
+    
+    def __init__(self, text, options):
+        self.text = sys.intern(text)
+        self.options = tuple(sys.intern(option) for option in options)
+
+# Build an immutable question set from parsed question dicts, skipping malformed ones
+def make_question_set(questions):
+    return tuple(
+        Question(str(q["question"]), [str(option) for option in q["options"]])
+        for q in questions
+        if isinstance(q, dict) and q.get("question") and q.get("options")
+    )
+
+# Rotating pool of pre-generated question sets per persona, refilled in the background
+class QuestionSetPool:
+    def __init__(self, personas, pool_size, low_water, workers, path=None):
+        self.pool_size = pool_size
+        self.low_water = low_water
+        self.path = path
+        self._fresh = {persona: deque() for persona in personas}
+        # Recently served sets are reused in rotation if the fresh sets run out
+        self._served = {persona: deque(maxlen=pool_size) for persona in personas}
+        self._refilling = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="svomo-questions")
+        self.hits = 0
+        self.misses = 0
+        self._load()
+    
+    # Seed the rotation with the sets an earlier process saved, so the first
+    # sessions after a restart don't have to wait for generation
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as pool_file:
+                saved = json.load(pool_file)
+            for persona, question_sets in saved.items():
+                if persona in self._served:
+                    for questions in question_sets[-self.pool_size:]:
+                        self._served[persona].append(tuple(Question(text, options) for text, options in questions))
+            logger.info(f"Loaded saved question sets for {len(saved)} personas")
+        except Exception as e:
+            logger.error(f"Error loading saved question sets: {e}")
+    
+    # Write the newest sets per persona; a per-thread temp file and rename keep
+    # replicas and concurrent refills sharing the file from reading a partial write
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = {
+                persona: [
+                    [[q.text, q.options] for q in questions]
+                    for questions in (list(self._served[persona]) + list(self._fresh[persona]))[-self.pool_size:]
+                ]
+                for persona in self._fresh
+            }
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as pool_file:
+                json.dump(snapshot, pool_file, separators=(",", ":"))
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving question sets: {e}")
+    
+    def warm(self):
+        for persona in self._fresh:
+            self._schedule_refill(persona)
+    
+    def take(self, persona):
+        with self._lock:
+            fresh = self._fresh.setdefault(persona, deque())
+            served = self._served.setdefault(persona, deque(maxlen=self.pool_size))
+            questions = None
+            if fresh:
+                questions = fresh.popleft()
+                served.append(questions)
+            elif served:
+                questions = served[0]
+                served.rotate(-1)
+            
+            if questions is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            needs_refill = len(fresh) <= self.low_water
+        
+        if needs_refill:
+            self._schedule_refill(persona)
+        
+        return questions
+    
+    def _schedule_refill(self, persona):
+        with self._lock:
+            if persona in self._refilling:
+                return
+            self._refilling.add(persona)
+        self._executor.submit(self._refill, persona)
+    
+    def _refill(self, persona):
+        with request_priority(PRIORITY_BACKGROUND):
+            self._refill_persona(persona)
+    
+    def _refill_persona(self, persona):
+        try:
+            # Stop after a few failed attempts so an outage doesn't loop forever
+            failures = 0
+            while failures < 3:
+                with self._lock:
+                    if len(self._fresh[persona]) >= self.pool_size:
+                        return
+                
+                questions = generate_questions(persona)
+                if is_valid_question_set(questions):
+                    with self._lock:
+                        self._fresh[persona].append(make_question_set(questions))
+                    logger.info(f"Added pre-generated question set for {persona}")
+                    self._save()
+                else:
+                    failures += 1
+                    logger.warning(f"Discarded invalid question set for {persona}")
+        except Exception as e:
+            logger.error(f"Error refilling question pool for {persona}: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(persona)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "fresh": sum(len(sets) for sets in self._fresh.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refilling": len(self._refilling)
+            }
+
+# Shared question-set pool, seeded from the sets saved by earlier processes and
+# refilled in the background from the first script run
+@st.cache_resource
+def get_question_pool():
+    pool = QuestionSetPool(PERSONA_OPTIONS, QUESTION_POOL_SIZE, QUESTION_POOL_LOW_WATER, QUESTION_POOL_WORKERS, QUESTION_POOL_PATH)
+    pool.warm()
+    return pool
+
+# Function to build the prompt for structured recommendations
+def build_structured_recommendation_prompt(answers, persona, previous_titles=None):
+    answers_text = "\n".join([f"Q: {q['question']}\nA: {q['answer']}" for q in answers])
+    
+    if previous_titles:
+        request_text = "recommend 3 MORE movies or shows that would be perfect for them"
+        previous_text = f"""
+    Previously recommended: {previous_titles}
+    
+    Please recommend DIFFERENT titles that are still aligned with their preferences.
+    """
+    else:
+        request_text = "recommend 3 movies or shows that would be perfect for them"
+        previous_text = ""
+    
+    prompt = f"""
+    Based on the following user preferences, {request_text}.
+    
+    User persona: {persona}
+    
+    User responses:
+    {answers_text}
+    {previous_text}
+    For each recommendation, provide:
+    1. title: The exact title (be precise for API searching)
+    2. year: The release year (just the year as a 4-digit number)
+    3. media_type: "movie" for films, "tv" for series
+    4. reason: A brief explanation of why this is a good match
+    5. pitch: A personalized, enthusiastic short description (max 100 words) that explains why the viewer
+       will enjoy it, in a retro, enthusiastic tone that matches a nostalgic movie recommendation system
+    
+    Be very accurate with movie titles to ensure they can be found in the TMDB database.
+    """
+    
+    return prompt
+
+# Function to validate one structured recommendation; returns None if unusable
+def validate_structured_recommendation(rec, index):
+    # The schema should guarantee these fields, but don't trust it blindly
+    if not isinstance(rec, dict) or not rec.get("title"):
+        logger.warning(f"Structured recommendation {index} missing title")
+        return None
+    rec["year"] = str(rec.get("year") or "")
+    rec["reason"] = rec.get("reason") or "Recommended based on your preferences"
+    if rec.get("media_type") not in ("movie", "tv"):
+        rec.pop("media_type", None)
+    return rec
+
+# Function to get recommendations, year, media type, reason and pitch in one
+# schema-validated Gemini call
+def get_structured_recommendations(answers, persona, previous_titles=None):
+    logger.info(f"Getting structured recommendations for persona: {persona} with {len(answers)} answers")
+    
+    prompt = build_structured_recommendation_prompt(answers, persona, previous_titles)
+    response = call_gemini_api(prompt, generation_config={
+        "responseMimeType": "application/json",
+        "responseSchema": RECOMMENDATION_SCHEMA
+    }, purpose="recommendations")
+    if not response:
+        logger.error("Failed to get structured response from Gemini API for recommendations")
+        return []
+    
+    try:
+        recommendations = json.loads(response)
+    except json.JSONDecodeError as e:
+        error_msg = f"JSON decode error in structured recommendations: {e}"
         logger.error(error_msg)
         logger.error(f"Failed JSON string: {response[:100]}...")
-        st.error(error_msg)
+        show_error(error_msg)
         return []
-    except Exception as e:
-        error_msg = f"Error parsing questions: {e}"
-        logger.error(error_msg)
-        st.error(error_msg)
+    
+    if not isinstance(recommendations, list):
+        logger.error("Structured recommendations response is not a JSON array")
         return []
+    
+    valid_recommendations = []
+    for i, rec in enumerate(recommendations):
+        rec = validate_structured_recommendation(rec, i)
+        if rec:
+            valid_recommendations.append(rec)
+    
+    logger.info(f"Successfully parsed {len(valid_recommendations)} structured recommendations")
+    return valid_recommendations
+
+# Function to stream structured recommendations, yielding each one as soon as
+# its JSON object has finished streaming
+def stream_recommendations(answers, persona, previous_titles=None):
+    logger.info(f"Streaming recommendations for persona: {persona} with {len(answers)} answers")
+    
+    prompt = build_structured_recommendation_prompt(answers, persona, previous_titles)
+    parser = IncrementalJsonArrayParser()
+    count = 0
+    for chunk in stream_gemini_api(prompt, generation_config={
+        "responseMimeType": "application/json",
+        "responseSchema": RECOMMENDATION_SCHEMA
+    }, purpose="recommendations"):
+        for rec in parser.feed(chunk):
+            rec = validate_structured_recommendation(rec, count)
+            count += 1
+            if rec:
+                logger.info(f"Streamed recommendation {count}: {rec['title']}")
+                yield rec
 
 # Function to get movie recommendations
 def get_recommendations(answers, persona):
+    if GEMINI_STRUCTURED_OUTPUT:
+        return get_structured_recommendations(answers, persona)
+    
     logger.info(f"Getting recommendations for persona: {persona} with {len(answers)} answers")
     
     # Construct a prompt for Gemini to generate movie recommendations
@@ -537,7 +2426,7 @@ def get_recommendations(answers, persona):
     Be very accurate with movie titles to ensure they can be found in the TMDB database.
     """
     
-    response = call_gemini_api(prompt)
+    response = call_gemini_api(prompt, purpose="recommendations")
     if not response:
         logger.error("Failed to get response from Gemini API for recommendations")
         return []
@@ -553,7 +2442,7 @@ def get_recommendations(answers, persona):
         if json_start == -1 or json_end == 0:
             error_msg = "Could not find JSON array in recommendation response"
             logger.error(error_msg)
-            st.error(error_msg)
+            show_error(error_msg)
             
             # Fallback to default recommendations if JSON extraction fails
             return [
@@ -600,16 +2489,218 @@ def get_recommendations(answers, persona):
         error_msg = f"JSON decode error in recommendations: {e}"
         logger.error(error_msg)
         logger.error(f"Failed JSON string: {response[:100]}...")
-        st.error(error_msg)
+        show_error(error_msg)
         return []
     except Exception as e:
         error_msg = f"Error parsing recommendations: {e}"
         logger.error(error_msg)
-        st.error(error_msg)
+        show_error(error_msg)
         return []
 
-# Function to search for movies/shows in TMDB
-def search_tmdb(title, year=None):
+# Normalize a title for index lookups: lowercase, "&" as "and", punctuation
+# and leading articles dropped
+def normalize_title(title):
+    title = str(title or "").lower().replace("&", " and ")
+    title = re.sub(r"[^\w\s]", " ", title)
+    words = title.split()
+    if len(words) > 1 and words[0] in ("the", "a", "an"):
+        words = words[1:]
+    return " ".join(words)
+
+# Candidate normalized keys for a title, exact first. The later keys are the
+# fuzzy fallback for near-miss titles from the model; hits on them only count
+# once the candidate's own title matches one of these keys too.
+def title_lookup_keys(title):
+    # "Title (2010)" -> "Title"
+    without_year = re.sub(r"\s*\(\d{4}\)\s*$", "", str(title or ""))
+    keys = [normalize_title(without_year)]
+    
+    # "Franchise: Subtitle" or "Franchise - Subtitle" -> "Franchise"
+    for separator in (":", " - "):
+        if separator in without_year:
+            keys.append(normalize_title(without_year.split(separator)[0]))
+    
+    # "Part 2" <-> "Part II"
+    numerals = {"2": "ii", "3": "iii", "4": "iv", "ii": "2", "iii": "3", "iv": "4"}
+    words = keys[0].split()
+    if words and words[-1] in numerals:
+        keys.append(" ".join(words[:-1] + [numerals[words[-1]]]))
+    
+    unique_keys = []
+    for key in keys:
+        if key and key not in unique_keys:
+            unique_keys.append(key)
+    return unique_keys
+
+def hash_title_key(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+# Build the compact title index from TMDB ID export files. Records are stored
+# as parallel arrays sorted by title-key hash so the file can be memory-mapped.
+# A title is indexed under its original title and, in enriched exports, its
+# display title; the year is 0 when the export has no date.
+def build_title_index(export_paths, output_path):
+    logger.info(f"Building title index from {export_paths}")
+    records = []
+    for media_type, export_path in export_paths.items():
+        type_code = 0 if media_type == "movie" else 1
+        original_field, title_field, date_field = (
+            ("original_title", "title", "release_date") if media_type == "movie"
+            else ("original_name", "name", "first_air_date")
+        )
+        with gzip.open(export_path, "rt", encoding="utf-8") as export_file:
+            for line in export_file:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if item.get("adult") or item.get("video") or not item.get("id"):
+                    continue
+                date = str(item.get(date_field) or "")
+                year = int(date[:4]) if date[:4].isdigit() else 0
+                keys = {normalize_title(item.get(original_field)), normalize_title(item.get(title_field))}
+                for key in keys - {""}:
+                    records.append((hash_title_key(key), item["id"], float(item.get("popularity") or 0), year, type_code))
+    
+    records.sort()
+    count = len(records)
+    
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Per-process temp file, so replicas rebuilding at the same time don't write over each other
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as index_file:
+        index_file.write(TitleIndex.HEADER.pack(TitleIndex.MAGIC, TitleIndex.VERSION, count))
+        index_file.write(struct.pack(f"<{count}Q", *[r[0] for r in records]))
+        index_file.write(struct.pack(f"<{count}I", *[r[1] for r in records]))
+        index_file.write(struct.pack(f"<{count}f", *[r[2] for r in records]))
+        index_file.write(struct.pack(f"<{count}H", *[r[3] for r in records]))
+        index_file.write(struct.pack(f"<{count}B", *[r[4] for r in records]))
+    os.replace(temp_path, output_path)
+    logger.info(f"Built title index with {count} titles at {output_path}")
+
+# Memory-mapped title index; lookups binary-search the sorted key hashes, so
+# the data stays in the shared page cache instead of per-process dicts
+class TitleIndex:
+    MAGIC = b"SVTI"
+    # Version 2 indexes were keyed on display titles only
+    VERSION = 3
+    HEADER = struct.Struct("<4sII4x")
+    
+    def __init__(self, path):
+        with open(path, "rb") as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic, version, count = self.HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"Unsupported title index format in {path}")
+        
+        view = memoryview(self._mmap)
+        offset = self.HEADER.size
+        self._keys = view[offset:offset + 8 * count].cast("Q")
+        offset += 8 * count
+        self._ids = view[offset:offset + 4 * count].cast("I")
+        offset += 4 * count
+        self._popularity = view[offset:offset + 4 * count].cast("f")
+        offset += 4 * count
+        self._years = view[offset:offset + 2 * count].cast("H")
+        offset += 2 * count
+        self._types = view[offset:offset + count].cast("B")
+        
+        self.count = count
+        self.hits = 0
+        self.misses = 0
+    
+    # Try the candidates for a title, exact key first and most popular first
+    # within each key, and return the first that confirm(candidate, exact)
+    # accepts. Gives up after TITLE_INDEX_MAX_CANDIDATES so the caller falls
+    # back to TMDB search; a known year must match, and one is required.
+    def lookup(self, title, year, media_type, confirm):
+        year = int(year) if str(year or "").isdigit() else 0
+        keys = title_lookup_keys(title)
+        if not year or not keys:
+            self.misses += 1
+            return None
+        
+        checked = 0
+        for position, key in enumerate(keys):
+            key_hash = hash_title_key(key)
+            start = bisect_left(self._keys, key_hash)
+            end = bisect_right(self._keys, key_hash, lo=start)
+            matches = [
+                i for i in range(start, end)
+                if self._years[i] in (0, year) and (media_type is None or self._types[i] == (0 if media_type == "movie" else 1))
+            ]
+            matches.sort(key=lambda i: self._popularity[i], reverse=True)
+            
+            for match in matches:
+                if checked == TITLE_INDEX_MAX_CANDIDATES:
+                    self.misses += 1
+                    return None
+                checked += 1
+                candidate = {
+                    "id": self._ids[match],
+                    "title": title,
+                    "media_type": "movie" if self._types[match] == 0 else "tv",
+                    "popularity": self._popularity[match]
+                }
+                if confirm(candidate, position == 0):
+                    self.hits += 1
+                    return candidate
+        
+        self.misses += 1
+        return None
+
+# Rebuild the title index off the request path, then drop the cached index so
+# the next lookup maps the new file
+def start_title_index_build(exports):
+    def build():
+        try:
+            build_title_index(exports, TITLE_INDEX_PATH)
+            get_title_index.clear()
+        except Exception as e:
+            logger.error(f"Error building title index: {e}")
+    
+    threading.Thread(target=build, name="svomo-title-index", daemon=True).start()
+
+# Shared title index, or None while none is available. An out-of-date or
+# missing index is rebuilt in the background; search uses the API meanwhile.
+@st.cache_resource
+def get_title_index():
+    exports = {media_type: path for media_type, path in TITLE_INDEX_EXPORTS.items() if os.path.exists(path)}
+    try:
+        index_mtime = os.path.getmtime(TITLE_INDEX_PATH) if os.path.exists(TITLE_INDEX_PATH) else 0
+        index = None
+        if index_mtime:
+            try:
+                index = TitleIndex(TITLE_INDEX_PATH)
+            except ValueError as e:
+                logger.warning(f"Ignoring title index: {e}")
+                index_mtime = 0
+        
+        if exports and any(os.path.getmtime(path) > index_mtime for path in exports.values()):
+            logger.info("Title index is out of date, rebuilding it in the background")
+            start_title_index_build(exports)
+        if index is None:
+            logger.info("No offline title index available, TMDB search will use the API")
+        return index
+    except Exception as e:
+        logger.error(f"Error loading title index: {e}")
+        return None
+
+# Check a title index candidate against its TMDB details, fetched into the
+# media store where resolving the title picks them up. The release year must
+# match, and a fuzzy hit's own title must be one of the requested title's keys.
+def confirm_indexed_title(candidate, title, year, exact):
+    media = get_media_store().lookup(candidate["media_type"], candidate["id"])
+    if not media or media.year != str(year):
+        return False
+    return exact or bool(set(title_lookup_keys(media.title)) & set(title_lookup_keys(title)))
+
+# Function to search for movies/shows in TMDB. media_type ("movie" or "tv"),
+# when known, is searched on its own first.
+def search_tmdb(title, year=None, media_type=None):
     logger.info(f"Searching TMDB for: '{title}', year: {year}")
     
     if not title:
@@ -637,147 +2728,1242 @@ def search_tmdb(title, year=None):
         except Exception as e:
             logger.warning(f"Error processing year parameter: {e}")
     
-    # First try searching for movies
-    movie_results = call_tmdb_api("search/movie", params)
+    # Resolve from the offline title index before touching the network
+    title_index = get_title_index()
+    if title_index:
+        indexed = title_index.lookup(
+            title, params.get("year"), media_type,
+            lambda candidate, exact: confirm_indexed_title(candidate, title, params.get("year"), exact)
+        )
+        if indexed:
+            logger.info(f"Found '{title}' in offline title index: {indexed['id']} (type: {indexed['media_type']})")
+            return indexed
+    
+    # Try the hinted media type alone before searching both
+    if media_type in ("movie", "tv"):
+        typed_results = call_tmdb_api(f"search/{media_type}", params)
+        if typed_results and typed_results.get("results"):
+            top_result = max(typed_results["results"][:3], key=lambda x: x.get("popularity", 0))
+            top_result["media_type"] = media_type
+            logger.info(f"Top result: {top_result.get('title', top_result.get('name', 'Unknown'))} (type: {media_type})")
+            return top_result
+        logger.info(f"No {media_type} results for '{title}', searching all media types")
+    
+    # First try searching for movies
+    movie_results = call_tmdb_api("search/movie", params)
+    
+    # Then try searching for TV shows
+    tv_results = call_tmdb_api("search/tv", params)
+    
+    results = []
+    
+    # Process movie results
+    if movie_results and "results" in movie_results:
+        logger.info(f"Found {len(movie_results['results'])} movie results")
+        for movie in movie_results["results"][:3]:  # Take top 3 results
+            movie["media_type"] = "movie"
+            results.append(movie)
+    else:
+        logger.warning("No movie results found")
+    
+    # Process TV results
+    if tv_results and "results" in tv_results:
+        logger.info(f"Found {len(tv_results['results'])} TV results")
+        for show in tv_results["results"][:3]:  # Take top 3 results
+            show["media_type"] = "tv"
+            results.append(show)
+    else:
+        logger.warning("No TV results found")
+    
+    # Sort by popularity and take top result
+    if results:
+        results.sort(key=lambda x: x.get("popularity", 0), reverse=True)
+        logger.info(f"Top result: {results[0].get('title', results[0].get('name', 'Unknown'))} (type: {results[0].get('media_type')})")
+        return results[0]
+    
+    # If no results with exact year, try without year
+    if year and not results:
+        logger.info(f"No results with year {year}, trying without year parameter")
+        params.pop("year", None)
+        
+        # Try again for movies
+        movie_results = call_tmdb_api("search/movie", params)
+        if movie_results and "results" in movie_results and movie_results["results"]:
+            for movie in movie_results["results"][:1]:
+                movie["media_type"] = "movie"
+                logger.info(f"Found movie without year filter: {movie.get('title', 'Unknown')}")
+                return movie
+        
+        # Try again for TV
+        tv_results = call_tmdb_api("search/tv", params)
+        if tv_results and "results" in tv_results and tv_results["results"]:
+            for show in tv_results["results"][:1]:
+                show["media_type"] = "tv"
+                logger.info(f"Found TV show without year filter: {show.get('name', 'Unknown')}")
+                return show
+    
+    logger.warning(f"No results found for '{title}'")
+    return None
+
+# Title details from TMDB, shared by every session that was recommended the title
+class MediaRecord:
+    __slots__ = ("media_type", "media_id", "title", "year", "poster_url", "poster_placeholder", "overview", "genres")
+    
+    def __init__(self, media_type, media_id, title, year, poster_url, poster_placeholder, overview, genres):
+        self.media_type = sys.intern(media_type)
+        self.media_id = media_id
+        self.title = title
+        self.year = sys.intern(year)
+        self.poster_url = poster_url
+        self.poster_placeholder = poster_placeholder
+        self.overview = overview
+        self.genres = sys.intern(genres)
+    
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+# One recommended title as a session holds it: the title's key in the media
+# store plus this user's reason and description
+class Recommendation:
+    __slots__ = ("media_type", "media_id", "reason", "ai_description")
+    
+    def __init__(self, media_type, media_id, reason, ai_description=None):
+        self.media_type = media_type
+        self.media_id = media_id
+        self.reason = reason
+        self.ai_description = ai_description
+    
+    def media(self):
+        return get_media_store().lookup(self.media_type, self.media_id)
+    
+    # Self-contained form for the persistent recommendation store
+    def to_dict(self):
+        media = self.media()
+        if not media:
+            return None
+        return {"media": media.to_dict(), "reason": self.reason, "ai_description": self.ai_description}
+    
+    @classmethod
+    def from_dict(cls, data):
+        media = get_media_store().intern(MediaRecord(**data["media"]))
+        return cls(media.media_type, media.media_id, data["reason"], data["ai_description"])
+
+# Process-wide media records keyed by (media type, TMDB id), so sessions hold
+# ids rather than their own copies of the same title. Least recently used
+# records are evicted beyond max_entries and fetched again on their next lookup.
+class MediaStore:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, media_type, media_id):
+        with self._lock:
+            record = self._records.get((media_type, media_id))
+            if record is None:
+                self.misses += 1
+                return None
+            self._records.move_to_end((media_type, media_id))
+            self.hits += 1
+            return record
+    
+    # Store a record, or return the one already stored for the same title
+    def intern(self, record):
+        key = (record.media_type, record.media_id)
+        with self._lock:
+            existing = self._records.get(key)
+            if existing is not None:
+                self._records.move_to_end(key)
+                return existing
+            
+            self._records[key] = record
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+                self.evictions += 1
+            return record
+    
+    def lookup(self, media_type, media_id):
+        return self.get(media_type, media_id) or fetch_media_record(media_type, media_id)
+    
+    def stats(self):
+        with self._lock:
+            records = list(self._records.values())
+            entries = len(records)
+        return {
+            "entries": entries,
+            "bytes": sum(deep_sizeof(record) for record in records),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+@st.cache_resource
+def get_media_store():
+    return MediaStore(MEDIA_STORE_MAX_ENTRIES)
+
+# Approximate memory held by a value, following builtin containers and slotted
+# records. Objects reached twice (e.g. interned strings) count once, and shared
+# objects such as executors and futures count only by their own size.
+# loadtest.py measures session state with this too.
+def deep_sizeof(value, seen=None):
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    elif hasattr(type(value), "__slots__"):
+        size += sum(deep_sizeof(getattr(value, field, None), seen) for field in type(value).__slots__)
+    return size
+
+# Memory held by the current session's state. Shared resources such as a
+# speculation's executor count only by their own size.
+def session_state_bytes():
+    seen = set()
+    return sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in st.session_state.to_dict().items())
+
+# Function to generate the "Why Watch This" description for a single title
+def generate_description(recommendation):
+    media = recommendation.media()
+    if not media:
+        return "No description available."
+    
+    prompt = f"""
+    Create a personalized, enthusiastic short description (max 100 words) for the {media.media_type} "{media.title}" (released in {media.year}).
+    
+    Official overview: {media.overview}
+    
+    Reason for recommendation: {recommendation.reason}
+    
+    Genres: {media.genres}
+    
+    Make it sound exciting and explain why the viewer will enjoy it based on their preferences.
+    Use a retro, enthusiastic tone that matches a nostalgic movie recommendation system.
+    """
+    
+    return call_gemini_api(prompt, purpose="descriptions") or "No description available."
+
+# Function to generate descriptions for several titles with a single Gemini call.
+# Titles missing from the batch response fall back to a per-title call.
+def generate_descriptions_batch(recommendations):
+    if not recommendations:
+        return
+    
+    if len(recommendations) == 1:
+        recommendations[0].ai_description = generate_description(recommendations[0])
+        return
+    
+    described = [(recommendation, recommendation.media()) for recommendation in recommendations]
+    titles_text = "\n\n".join([
+        f"""ID: {idx}
+    Title: {media.title} ({media.media_type}, released in {media.year})
+    Official overview: {media.overview}
+    Reason for recommendation: {recommendation.reason}
+    Genres: {media.genres}"""
+        for idx, (recommendation, media) in enumerate(described, start=1)
+        if media
+    ])
+    prompt = f"""
+    Create a personalized, enthusiastic short description (max 100 words each) for every title below.
+    
+    {titles_text}
+    
+    Make each one sound exciting and explain why the viewer will enjoy it based on their preferences.
+    Use a retro, enthusiastic tone that matches a nostalgic movie recommendation system.
+    
+    Format your response as a JSON object mapping each ID to its description:
+    {{
+      "1": "Description for the first title",
+      "2": "Description for the second title"
+    }}
+    
+    Make sure your response is properly formatted and valid JSON.
+    """
+    
+    logger.info(f"Generating descriptions for {len(recommendations)} titles in one batch")
+    response = call_gemini_api(prompt, purpose="description_batch")
+    
+    descriptions = {}
+    if response:
+        try:
+            json_start = response.find('{')
+            json_end = response.rfind('}') + 1
+            if json_start != -1 and json_end != 0:
+                descriptions = json.loads(response[json_start:json_end])
+            else:
+                logger.error("Could not find JSON object in batch description response")
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error in batch descriptions: {e}")
+    
+    for idx, (recommendation, media) in enumerate(described, start=1):
+        description = descriptions.get(str(idx))
+        if isinstance(description, str) and description.strip():
+            recommendation.ai_description = description.strip()
+        elif media:
+            logger.warning(f"Batch description missing for '{media.title}', falling back to single call")
+            recommendation.ai_description = generate_description(recommendation)
+        else:
+            recommendation.ai_description = "No description available."
+
+# Fetch a title's details from TMDB into the media store.
+# Returns the stored MediaRecord, or None if TMDB has no such title.
+def fetch_media_record(media_type, media_id):
+    if media_type == "movie":
+        details = call_tmdb_api(f"movie/{media_id}")
+    else:
+        details = call_tmdb_api(f"tv/{media_id}")
+    
+    if not details:
+        return None
+    
+    # Get poster; building its placeholder also warms the poster cache off the render path
+    poster_path = details.get("poster_path")
+    poster_url = get_movie_poster(poster_path)
+    poster_placeholder = get_poster_placeholder(poster_url)
+    
+    # Format release date/year
+    if media_type == "movie":
+        release_date = details.get("release_date", "")
+        year = release_date[:4] if release_date else "Unknown"
+        title = details.get("title", "Unknown")
+    else:
+        first_air_date = details.get("first_air_date", "")
+        year = first_air_date[:4] if first_air_date else "Unknown"
+        title = details.get("name", "Unknown")
+    
+    # Get genres
+    genres = ", ".join([g.get("name", "") for g in details.get("genres", [])])
+    
+    return get_media_store().intern(MediaRecord(
+        media_type,
+        media_id,
+        title,
+        year,
+        poster_url,
+        poster_placeholder,
+        details.get("overview", ""),
+        genres
+    ))
+
+# Function to get movie/show details with AI description, as a Recommendation.
+# With describe=False the description is left for generate_descriptions_batch.
+def get_media_details(item, reason, describe=True):
+    if not item:
+        return None
+    
+    media_type = item.get("media_type", "movie")
+    item_id = item.get("id")
+    
+    media = get_media_store().lookup(media_type, item_id)
+    if not media:
+        return None
+    
+    recommendation = Recommendation(media.media_type, media.media_id, reason)
+    
+    # Generate AI description
+    if describe:
+        recommendation.ai_description = generate_description(recommendation)
+    
+    return recommendation
+
+# Function to display movie/show card
+def display_media_card(recommendation):
+    media = recommendation.media() if recommendation else None
+    if not media:
+        return
+    
+    with st.container():
+        st.markdown(f'<div class="retro-card">', unsafe_allow_html=True)
+        
+        col1, col2 = st.columns([1, 2])
+        
+        with col1:
+            # The blurred placeholder is painted as the background until the poster has loaded over it
+            placeholder = media.poster_placeholder
+            style = f"object-fit: cover; background: url({placeholder}) center / cover no-repeat;" if placeholder else "object-fit: cover;"
+            st.markdown(
+                f'<img src="{get_poster_src(media.poster_url)}" alt="{html.escape(media.title)}" '
+                f'width="{POSTER_DISPLAY_WIDTH}" height="{POSTER_DISPLAY_WIDTH * 3 // 2}" style="{style}">',
+                unsafe_allow_html=True
+            )
+        
+        with col2:
+            st.markdown(f"### {media.title} ({media.year})")
+            st.markdown(f"**Type:** {'Movie' if media.media_type == 'movie' else 'TV Show'}")
+            st.markdown(f"**Genres:** {media.genres}")
+            st.markdown("### Why Watch This:")
+            st.markdown(f"{recommendation.ai_description}")
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+
+# Shared worker pool for resolving recommendations against TMDB
+@st.cache_resource
+def get_resolve_executor():
+    return ThreadPoolExecutor(max_workers=RESOLVE_POOL_WORKERS, thread_name_prefix="svomo-resolve")
+
+# Resolve a single recommendation to its full media details
+def resolve_recommendation(rec):
+    title = rec.get("title", "")
+    year = rec.get("year", "")
+    reason = rec.get("reason", "")
+    
+    logger.info(f"Searching for: {title} ({year})")
+    
+    # Search for the movie/show in TMDB
+    result = search_tmdb(title, year, rec.get("media_type"))
+    if not result:
+        logger.warning(f"No match found for '{title}' in TMDB")
+        return None
+    logger.info(f"Found match for '{title}' in TMDB: {result.get('id')}")
+    
+    # Get detailed information; descriptions are written afterwards in one batch
+    # unless the recommendation already came with a pitch
+    details = get_media_details(result, reason, describe=False)
+    if details:
+        logger.info(f"Successfully got details for '{title}'")
+        if rec.get("pitch"):
+            details.ai_description = rec["pitch"]
+    else:
+        logger.warning(f"Failed to get details for '{title}'")
+    return details
+
+# Resolve recommendations concurrently, keeping their original order, then
+# describe all of them with one batched Gemini call.
+# A failed item becomes None without affecting the others.
+def resolve_recommendations(recommendations, on_progress=None):
+    executor = get_resolve_executor()
+    ctx = get_script_run_ctx()
+    # Hand on the priority as set, so promoting a speculative run reaches its workers
+    priority = getattr(_request_context, "priority", PRIORITY_INTERACTIVE)
+    slots = threading.BoundedSemaphore(RESOLVE_MAX_CONCURRENCY_PER_SESSION)
+    
+    def run(rec):
+        # Attach the session's script context so st.error calls still reach the page,
+        # and keep the caller's rate-limit priority
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            with request_priority(priority):
+                return resolve_recommendation(rec)
+        finally:
+            add_script_run_ctx(threading.current_thread(), None)
+            slots.release()
+    
+    futures = {}
+    for idx, rec in enumerate(recommendations):
+        slots.acquire()
+        try:
+            futures[executor.submit(run, rec)] = idx
+        except Exception:
+            # The worker never started, so it can't give its slot back
+            slots.release()
+            raise
+    
+    results = [None] * len(recommendations)
+    for completed, future in enumerate(as_completed(futures), start=1):
+        idx = futures[future]
+        title = recommendations[idx].get("title", "")
+        try:
+            results[idx] = future.result()
+        except Exception as e:
+            logger.error(f"Error resolving '{title}': {e}")
+        if on_progress:
+            on_progress(completed, len(recommendations), title)
+    
+    generate_descriptions_batch([details for details in results if details and not details.ai_description])
+    
+    return results
+
+# Stream recommendations from Gemini and resolve each one on the shared pool as
+# soon as it has finished streaming. Yields (index, recommendation, details)
+# in completion order; details is None when the title could not be resolved.
+# Closing the generator (e.g. when the script run is stopped) cancels the
+# stream and any resolutions that haven't started.
+def stream_and_resolve_recommendations(answers, persona, previous_titles=None):
+    executor = get_resolve_executor()
+    ctx = get_script_run_ctx()
+    events = queue.Queue()
+    slots = threading.BoundedSemaphore(RESOLVE_MAX_CONCURRENCY_PER_SESSION)
+    cancelled = threading.Event()
+    
+    def resolve(idx, rec):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        details = None
+        try:
+            if cancelled.is_set():
+                return
+            details = resolve_recommendation(rec)
+            # Cards are shown one at a time, so there is no batch to join
+            if details and not details.ai_description:
+                details.ai_description = generate_description(details)
+        except Exception as e:
+            logger.error(f"Error resolving '{rec.get('title', '')}': {e}")
+        finally:
+            add_script_run_ctx(threading.current_thread(), None)
+            slots.release()
+            events.put(("resolved", idx, rec, details))
+    
+    def produce():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        count = 0
+        try:
+            for rec in stream_recommendations(answers, persona, previous_titles):
+                # Leaving the loop closes the stream, and with it the Gemini response
+                if cancelled.is_set():
+                    logger.info("Recommendation stream cancelled")
+                    break
+                slots.acquire()
+                try:
+                    executor.submit(resolve, count, rec)
+                except Exception:
+                    slots.release()
+                    raise
+                count += 1
+        except Exception as e:
+            logger.error(f"Error streaming recommendations: {e}")
+        finally:
+            add_script_run_ctx(threading.current_thread(), None)
+            events.put(("finished", count, None, None))
+    
+    threading.Thread(target=produce, name="svomo-stream", daemon=True).start()
+    
+    total = None
+    received = 0
+    try:
+        while total is None or received < total:
+            kind, idx, rec, details = events.get()
+            if kind == "finished":
+                total = idx
+            else:
+                received += 1
+                yield idx, rec, details
+    finally:
+        cancelled.set()
+
+# Stream, resolve and render recommendation cards as they arrive.
+# Returns the recommendations and their media details in the model's order.
+def stream_recommendation_cards(answers, persona, previous_titles=None):
+    cards = st.container()
+    resolved = {}
+    # Closed as soon as the run stops, so the stream doesn't outlive it
+    with contextlib.closing(stream_and_resolve_recommendations(answers, persona, previous_titles)) as stream:
+        for idx, rec, details in stream:
+            resolved[idx] = (rec, details)
+            if details:
+                with cards:
+                    display_media_card(details)
+    
+    ordered = [resolved[idx] for idx in sorted(resolved)]
+    recommendations = [rec for rec, _ in ordered]
+    media_details = [details for _, details in ordered if details]
+    return recommendations, media_details
+
+# Process-wide counters for speculative prefetch, used to tune the threshold
+class SpeculationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.wasted_runs = 0
+        self.wasted_recommendation_calls = 0
+        self.wasted_title_resolutions = 0
+    
+    def record(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+    
+    def record_waste(self, recommendation_calls, title_resolutions):
+        with self._lock:
+            self.wasted_runs += 1
+            self.wasted_recommendation_calls += recommendation_calls
+            self.wasted_title_resolutions += title_resolutions
+    
+    def stats(self):
+        with self._lock:
+            finished = self.hits + self.misses
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / finished if finished else 0.0,
+                "timeouts": self.timeouts,
+                "wasted_runs": self.wasted_runs,
+                "wasted_recommendation_calls": self.wasted_recommendation_calls,
+                "wasted_title_resolutions": self.wasted_title_resolutions
+            }
+
+@st.cache_resource
+def get_speculation_stats():
+    return SpeculationStats()
+
+# Separate pool so speculative work never queues ahead of interactive requests
+@st.cache_resource
+def get_speculation_executor():
+    return ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="svomo-speculate")
+
+# One background recommendation run built from a snapshot of the answers so far
+class SpeculativeRun:
+    def __init__(self, persona, answers):
+        self.persona = persona
+        self.answers = [dict(answer) for answer in answers]
+        self.cancelled = threading.Event()
+        self.priority = PRIORITY_SPECULATIVE
+        self.future = None
+        self.recommendation_calls = 0
+        self.title_resolutions = 0
+        self._waste_recorded = False
+        self._lock = threading.Lock()
+    
+    def start(self):
+        self.future = get_speculation_executor().submit(self._run)
+        self.future.add_done_callback(self._on_done)
+        get_speculation_stats().record("started")
+    
+    def _run(self):
+        with request_priority(lambda: self.priority):
+            return self._speculate()
+    
+    # A session is now waiting on this run, so its remaining calls are interactive
+    def promote(self):
+        self.priority = PRIORITY_INTERACTIVE
+    
+    def _speculate(self):
+        logger.info(f"Speculating recommendations from {len(self.answers)} answers")
+        self.recommendation_calls += 1
+        recommendations = get_recommendations(self.answers, self.persona)
+        if self.cancelled.is_set() or not recommendations:
+            return None
+        
+        self.title_resolutions += len(recommendations)
+        resolved = resolve_recommendations(recommendations)
+        if self.cancelled.is_set():
+            return None
+        
+        return recommendations, [details for details in resolved if details]
     
-    # Then try searching for TV shows
-    tv_results = call_tmdb_api("search/tv", params)
+    def cancel(self):
+        self.cancelled.set()
+        # A run still in flight records its waste when it finishes
+        if self.future is None or self.future.done():
+            self._record_waste()
     
-    results = []
+    def _on_done(self, future):
+        if self.cancelled.is_set():
+            self._record_waste()
     
-    # Process movie results
-    if movie_results and "results" in movie_results:
-        logger.info(f"Found {len(movie_results['results'])} movie results")
-        for movie in movie_results["results"][:3]:  # Take top 3 results
-            movie["media_type"] = "movie"
-            results.append(movie)
-    else:
-        logger.warning("No movie results found")
+    def _record_waste(self):
+        with self._lock:
+            if self._waste_recorded:
+                return
+            self._waste_recorded = True
+        get_speculation_stats().record_waste(self.recommendation_calls, self.title_resolutions)
     
-    # Process TV results
-    if tv_results and "results" in tv_results:
-        logger.info(f"Found {len(tv_results['results'])} TV results")
-        for show in tv_results["results"][:3]:  # Take top 3 results
-            show["media_type"] = "tv"
-            results.append(show)
-    else:
-        logger.warning("No TV results found")
+    # Only a run built from exactly these answers can stand in for a normal run
+    def covers(self, persona, answers):
+        return persona == self.persona and answers == self.answers
+
+# Cancel the session's in-flight speculative runs, if any
+def cancel_speculation():
+    runs = st.session_state.get("speculation")
+    if runs:
+        for run in runs:
+            run.cancel()
+        st.session_state.speculation = None
+
+# Start one speculative run per possible answer once only the last question is left
+def maybe_start_speculation():
+    if not SPECULATIVE_PREFETCH:
+        return
     
-    # Sort by popularity and take top result
-    if results:
-        results.sort(key=lambda x: x.get("popularity", 0), reverse=True)
-        logger.info(f"Top result: {results[0].get('title', results[0].get('name', 'Unknown'))} (type: {results[0].get('media_type')})")
-        return results[0]
+    questions = st.session_state.questions
+    if len(st.session_state.choices) != len(questions) - 1:
+        return
     
-    # If no results with exact year, try without year
-    if year and not results:
-        logger.info(f"No results with year {year}, trying without year parameter")
-        params.pop("year", None)
-        
-        # Try again for movies
-        movie_results = call_tmdb_api("search/movie", params)
-        if movie_results and "results" in movie_results and movie_results["results"]:
-            for movie in movie_results["results"][:1]:
-                movie["media_type"] = "movie"
-                logger.info(f"Found movie without year filter: {movie.get('title', 'Unknown')}")
-                return movie
-        
-        # Try again for TV
-        tv_results = call_tmdb_api("search/tv", params)
-        if tv_results and "results" in tv_results and tv_results["results"]:
-            for show in tv_results["results"][:1]:
-                show["media_type"] = "tv"
-                logger.info(f"Found TV show without year filter: {show.get('name', 'Unknown')}")
-                return show
+    last_question = questions[-1]
+    if len(last_question.options) > SPECULATIVE_MAX_BRANCHES:
+        return
     
-    logger.warning(f"No results found for '{title}'")
-    return None
+    cancel_speculation()
+    answers = get_answers()
+    runs = []
+    for option in last_question.options:
+        run = SpeculativeRun(st.session_state.persona, answers + [{"question": last_question.text, "answer": option}])
+        run.start()
+        runs.append(run)
+    st.session_state.speculation = runs
 
-# Function to get movie/show details with AI description
-def get_media_details(item, reason):
-    if not item:
+# Use the session's speculative run for exactly the final answers, if there is one,
+# and cancel the rest. Returns (recommendations, media_details, answers the run
+# was built from) or None.
+def take_speculation(answers, persona):
+    runs = st.session_state.get("speculation")
+    st.session_state.speculation = None
+    if not runs:
         return None
     
-    media_type = item.get("media_type", "movie")
-    item_id = item.get("id")
+    stats = get_speculation_stats()
+    run = None
+    for candidate in runs:
+        if run is None and candidate.covers(persona, answers):
+            run = candidate
+        else:
+            candidate.cancel()
+    if run is None:
+        logger.info("No speculative run matches the final answers")
+        stats.record("misses")
+        return None
     
-    if media_type == "movie":
-        details = call_tmdb_api(f"movie/{item_id}")
-    else:
-        details = call_tmdb_api(f"tv/{item_id}")
+    # A run still queued behind other sessions' runs has done nothing yet
+    if run.future.cancel():
+        logger.info("Speculative run for the final answers hadn't started, running normally")
+        run.cancel()
+        stats.record("misses")
+        return None
     
-    if not details:
+    run.promote()
+    try:
+        result = run.future.result(timeout=SPECULATIVE_MAX_WAIT)
+    except TimeoutError:
+        logger.warning(f"Speculative run for the final answers still running after {SPECULATIVE_MAX_WAIT}s, running normally")
+        run.cancel()
+        stats.record("timeouts")
+        result = None
+    except Exception as e:
+        logger.error(f"Speculative recommendation run failed: {e}")
+        result = None
+    
+    if not result or not result[1]:
+        stats.record("misses")
         return None
     
-    # Get poster
-    poster_path = details.get("poster_path")
-    poster_url = get_movie_poster(poster_path)
+    logger.info(f"Reusing speculative recommendations built from {len(run.answers)} answers")
+    stats.record("hits")
+    recommendations, media_details = result
+    return recommendations, media_details, run.answers
+
+# Canonical cache key for a persona and its ordered question/answer pairs
+def make_recommendation_cache_key(persona, answers):
+    def normalize(text):
+        return " ".join(str(text or "").lower().split())
     
-    # Format release date/year
-    if media_type == "movie":
-        release_date = details.get("release_date", "")
-        year = release_date[:4] if release_date else "Unknown"
-        title = details.get("title", "Unknown")
-    else:
-        first_air_date = details.get("first_air_date", "")
-        year = first_air_date[:4] if first_air_date else "Unknown"
-        title = details.get("name", "Unknown")
+    canonical = json.dumps({
+        "persona": normalize(persona),
+        "answers": [[normalize(a.get("question")), normalize(a.get("answer"))] for a in answers]
+    }, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# SQLite-backed store of fully resolved recommendations, with TTL and
+# least-recently-used eviction once the stored payloads exceed max_bytes
+class RecommendationStore:
+    def __init__(self, path, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS recommendations (
+                key TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS recommendations_accessed ON recommendations (accessed_at)")
     
-    # Get genres
-    genres = ", ".join([g.get("name", "") for g in details.get("genres", [])])
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, created_at FROM recommendations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            
+            payload, created_at = row
+            if created_at + self.ttl <= now:
+                self._conn.execute("DELETE FROM recommendations WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            
+            self._conn.execute("UPDATE recommendations SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        
+        record = json.loads(zlib.decompress(payload))
+        # Rows written before titles moved to the media store have no "picks"
+        if "picks" not in record:
+            return None
+        return record["recommendations"], [Recommendation.from_dict(pick) for pick in record["picks"]]
     
-    # Generate AI description
-    overview = details.get("overview", "")
-    prompt = f"""
-    Create a personalized, enthusiastic short description (max 100 words) for the {media_type} "{title}" (released in {year}).
+    # media_details are Recommendation records, stored with their titles' details
+    # so a hit doesn't have to go back to TMDB
+    def put(self, key, recommendations, media_details):
+        picks = [details.to_dict() for details in media_details]
+        payload = zlib.compress(json.dumps({
+            "recommendations": recommendations,
+            "picks": [pick for pick in picks if pick]
+        }, separators=(",", ":")).encode("utf-8"))
+        now = time.time()
+        
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recommendations (key, payload, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now)
+            )
+            self._evict(now)
+    
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM recommendations WHERE created_at <= ?", (now - self.ttl,))
+        
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM recommendations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        # Drop least recently used entries until we are back under budget
+        excess = total - self.max_bytes
+        freed = 0
+        stale_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM recommendations ORDER BY accessed_at"):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM recommendations WHERE key = ?", stale_keys)
+        logger.info(f"Evicted {len(stale_keys)} cached recommendation sets")
     
-    Official overview: {overview}
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM recommendations"
+            ).fetchone()
+            return {
+                "entries": entries,
+                "bytes": total,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+# Shared recommendation store, opened once per process
+@st.cache_resource
+def get_recommendation_store():
+    return RecommendationStore(RECOMMENDATION_CACHE_PATH, RECOMMENDATION_CACHE_TTL, RECOMMENDATION_CACHE_MAX_BYTES)
+
+# Session store backed by a SQLite file in WAL mode, so several processes can
+# read and write it at once. Snapshots are compressed bytes from encode_session().
+# save() and delete() only queue the latest snapshot per token; a background
+# thread writes the queue in batches, so a slow or locked database never holds
+# up a page. A batch that can't be written is dropped (the next save of each
+# session replaces it) and counted. Any object with the same
+# load/save/delete/stats methods can stand in for it.
+class SqliteSessionStore:
+    def __init__(self, path, ttl, timeout):
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.loads = 0
+        self.resumed = 0
+        self.saves = 0
+        self.failed_saves = 0
+        # token -> payload, or None for a delete; _writing is the batch being written
+        self._pending = {}
+        self._writing = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = self._connect()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                token TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)")
+        threading.Thread(target=self._write_loop, name="svomo-session-writer", daemon=True).start()
     
-    Reason for recommendation: {reason}
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=self.timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
     
-    Genres: {genres}
+    # The decoded session stored under token, or None. Only a snapshot that
+    # `decode` accepts counts as resumed.
+    def load(self, token, decode):
+        with self._lock:
+            self.loads += 1
+            # A snapshot from this process that isn't written yet is the newest one
+            if token in self._pending or token in self._writing:
+                payload = self._pending[token] if token in self._pending else self._writing[token]
+            else:
+                row = self._conn.execute(
+                    "SELECT payload FROM sessions WHERE token = ? AND updated_at > ?", (token, time.time() - self.ttl)
+                ).fetchone()
+                payload = row[0] if row else None
+        
+        state = decode(payload) if payload else None
+        if state is not None:
+            with self._lock:
+                self.resumed += 1
+        return state
     
-    Make it sound exciting and explain why the viewer will enjoy it based on their preferences.
-    Use a retro, enthusiastic tone that matches a nostalgic movie recommendation system.
-    """
+    def save(self, token, payload):
+        with self._lock:
+            self._pending[token] = payload
+        self._wakeup.set()
     
-    ai_description = call_gemini_api(prompt) or "No description available."
+    def delete(self, token):
+        self.save(token, None)
     
-    return {
-        "title": title,
-        "year": year,
-        "poster_url": poster_url,
-        "overview": overview,
-        "genres": genres,
-        "ai_description": ai_description,
-        "media_type": media_type,
-        "reason": reason
-    }
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                self._wakeup.clear()
+                self._writing, self._pending = self._pending, {}
+                batch = self._writing
+            
+            now = time.time()
+            saves = [(token, payload, now) for token, payload in batch.items() if payload is not None]
+            deletes = [(token,) for token, payload in batch.items() if payload is None]
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT OR REPLACE INTO sessions (token, payload, updated_at) VALUES (?, ?, ?)", saves)
+                conn.executemany("DELETE FROM sessions WHERE token = ?", deletes)
+                # Expired sessions are swept now and then rather than on every write
+                if random.random() < 0.01:
+                    conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (now - self.ttl,))
+                conn.execute("COMMIT")
+                failed = 0
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                failed = len(saves)
+                logger.error(f"Error writing {len(batch)} stored sessions: {e}")
+            
+            with self._lock:
+                self._writing = {}
+                self.saves += len(saves) - failed
+                self.failed_saves += failed
+    
+    def stats(self):
+        with self._lock:
+            sessions, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM sessions"
+            ).fetchone()
+            return {
+                "sessions": sessions,
+                "bytes": total,
+                "loads": self.loads,
+                "resumed": self.resumed,
+                "saves": self.saves,
+                "failed_saves": self.failed_saves,
+                "queued": len(self._pending) + len(self._writing)
+            }
 
-# Function to display movie/show card
-def display_media_card(media):
-    if not media:
+SESSION_STORE_BACKENDS = {
+    "sqlite": lambda: SqliteSessionStore(SESSION_STORE_PATH, SESSION_STORE_TTL, SESSION_STORE_TIMEOUT)
+}
+
+# Shared session store, or None when sessions are kept in process only
+@st.cache_resource
+def get_session_store():
+    if SESSION_STORE == "none":
+        return None
+    if SESSION_STORE not in SESSION_STORE_BACKENDS:
+        logger.error(f"Unknown SESSION_STORE '{SESSION_STORE}', keeping sessions in process only")
+        return None
+    return SESSION_STORE_BACKENDS[SESSION_STORE]()
+
+# Compact snapshot of the session: field values in a fixed order with questions
+# and recommendations flattened to lists, as compressed JSON. Title details are
+# left to the media store, which refetches them by id on another replica.
+SESSION_FORMAT_VERSION = 1
+
+def encode_session(state):
+    snapshot = [
+        SESSION_FORMAT_VERSION,
+        state.step,
+        state.persona,
+        [[q.text, q.options] for q in state.questions],
+        state.current_question,
+        state.choices,
+        [[r.media_type, r.media_id, r.reason, r.ai_description] for r in state.recommendations],
+        state.load_more_count,
+        state.variety
+    ]
+    return zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode("utf-8"))
+
+# Decode a snapshot into session_state values, or None if it can't be used
+def decode_session(payload):
+    try:
+        snapshot = json.loads(zlib.decompress(payload))
+        if snapshot[0] != SESSION_FORMAT_VERSION:
+            return None
+        _, step, persona, questions, current_question, choices, recommendations, load_more_count, variety = snapshot
+        return {
+            "step": step,
+            "persona": persona,
+            "questions": tuple(Question(text, options) for text, options in questions),
+            "current_question": current_question,
+            "choices": choices,
+            "recommendations": [Recommendation(*fields) for fields in recommendations],
+            "load_more_count": load_more_count,
+            "variety": variety
+        }
+    except Exception as e:
+        logger.error(f"Error decoding stored session: {e}")
+        return None
+
+# Restore the session named by the URL's session token, or give this session a
+# new token. Runs once per browser session, before the defaults are filled in.
+def resume_session():
+    if "session_token" in st.session_state:
         return
     
-    with st.container():
-        st.markdown(f'<div class="retro-card">', unsafe_allow_html=True)
+    store = get_session_store()
+    token = st.query_params.get("session")
+    if store and token and SESSION_TOKEN_PATTERN.fullmatch(token):
+        try:
+            state = store.load(token, decode_session)
+        except Exception as e:
+            logger.error(f"Error loading stored session: {e}")
+            state = None
+        if state:
+            logger.info(f"Resuming stored session at step {state['step']}")
+            for key, value in state.items():
+                st.session_state[key] = value
+            st.session_state.session_token = token
+            return
+    
+    st.session_state.session_token = secrets.token_urlsafe(16)
+    if store:
+        st.query_params["session"] = st.session_state.session_token
+
+# Persist the session after a transition so any replica can pick it up. Only
+# the snapshot is taken here; the store writes it in the background.
+def save_session():
+    store = get_session_store()
+    if not store:
+        return
+    try:
+        store.save(st.session_state.session_token, encode_session(st.session_state))
+    except Exception as e:
+        # The session carries on in process; only resuming elsewhere is lost
+        logger.error(f"Error saving session: {e}")
+
+# Start over: forget the stored session and its token along with the session state
+def reset_session():
+    cancel_speculation()
+    store = get_session_store()
+    if store and "session_token" in st.session_state:
+        store.delete(st.session_state.session_token)
+    if "session" in st.query_params:
+        del st.query_params["session"]
+    st.session_state.clear()
+
+# Rerun only the current fragment. A fragment can also execute as part of a full
+# app run (e.g. a click that arrived while the app was rerunning), where a
+# fragment-scoped rerun isn't allowed, so the whole app is rerun instead.
+def rerun_fragment():
+    ctx = get_script_run_ctx()
+    if ctx and ctx.fragment_ids_this_run:
+        st.rerun(scope="fragment")
+    st.rerun()
+
+# Fetch and resolve more recommendations, adding them to the session
+@timed_step("loading_more")
+def load_more_recommendations():
+    st.markdown('<div class="retro-card crt-effect">', unsafe_allow_html=True)
+    st.markdown("## FINDING MORE RECOMMENDATIONS...")
+    st.markdown('<div class="loading-animation"></div>', unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Create a more specific prompt based on previous recommendations
+    previous_titles = ", ".join([media.title for media in (rec.media() for rec in st.session_state.recommendations) if media])
+    answers = get_answers()
+    
+    try:
+        if GEMINI_STREAMING:
+            _, new_media_details = stream_recommendation_cards(
+                answers,
+                st.session_state.persona,
+                previous_titles
+            )
+        elif GEMINI_STRUCTURED_OUTPUT:
+            new_recommendations = get_structured_recommendations(
+                answers,
+                st.session_state.persona,
+                previous_titles
+            )
+        else:
+            answers_text = "\n".join([f"Q: {q['question']}\nA: {q['answer']}" for q in answers])
         
-        col1, col2 = st.columns([1, 2])
+            prompt = f"""
+            Based on the following user preferences, recommend 3 MORE movies or shows that would be perfect for them.
+            
+            User persona: {st.session_state.persona}
+            
+            User responses:
+            {answers_text}
+            
+            Previously recommended: {previous_titles}
+            
+            Please recommend DIFFERENT titles that are still aligned with their preferences.
+            
+            For each recommendation, provide:
+            1. The exact title (be precise for API searching)
+            2. The release year
+            3. A brief explanation of why this is a good match
+            
+            Format your response as a JSON array:
+            [
+              {{
+                "title": "Movie Title",
+                "year": "YYYY",
+                "reason": "Brief explanation"
+              }},
+              ...
+            ]
+            """
         
-        with col1:
-            st.image(media["poster_url"], width=200)
+            more_recommendations = call_gemini_api(prompt, purpose="recommendations")
         
-        with col2:
-            st.markdown(f"### {media['title']} ({media['year']})")
-            st.markdown(f"**Type:** {'Movie' if media['media_type'] == 'movie' else 'TV Show'}")
-            st.markdown(f"**Genres:** {media['genres']}")
-            st.markdown("### Why Watch This:")
-            st.markdown(f"{media['ai_description']}")
+            # Extract JSON from the response
+            json_start = more_recommendations.find('[')
+            json_end = more_recommendations.rfind(']') + 1
+            json_str = more_recommendations[json_start:json_end]
+        
+            new_recommendations = json.loads(json_str)
+    
+        if not GEMINI_STREAMING:
+            # Get details for each new recommendation in parallel
+            resolved = resolve_recommendations(new_recommendations)
+            new_media_details = [details for details in resolved if details]
+    
+        # Add new recommendations to existing ones
+        room = MAX_SESSION_RECOMMENDATIONS - len(st.session_state.recommendations)
+        st.session_state.recommendations.extend(new_media_details[:room])
+    except Exception as e:
+        st.error(f"Error loading more recommendations: {e}")
+
+# Recommendation cards with the load-more and start-over buttons, rerun on
+# their own so loading more doesn't redraw the rest of the page
+@st.fragment
+@timed_step("recommendation_list")
+def recommendation_list():
+    # Display recommendations
+    if st.session_state.recommendations:
+        for recommendation in st.session_state.recommendations:
+            display_media_card(recommendation)
         
+        # Load more button; new cards are fetched and drawn within this fragment
+        if len(st.session_state.recommendations) >= MAX_SESSION_RECOMMENDATIONS:
+            st.markdown("That's every recommendation for this session. Start over for a fresh set!")
+        elif st.button("LOAD MORE RECOMMENDATIONS"):
+            st.session_state.load_more_count += 1
+            load_more_recommendations()
+            save_session()
+            rerun_fragment()
+    else:
+        st.markdown('<div class="retro-card">', unsafe_allow_html=True)
+        st.markdown("## No recommendations found. Let's try again!")
+        if st.button("START OVER"):
+            reset_session()
+            st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Start over button
+    if st.button("START OVER", key="restart_button"):
+        reset_session()
+        st.rerun()
+
+# The session's question/answer pairs so far, expanded from the chosen option
+# indices into the form the prompts and cache keys use
+def get_answers():
+    questions = st.session_state.questions
+    return [
+        {"question": questions[idx].text, "answer": questions[idx].options[choice]}
+        for idx, choice in enumerate(st.session_state.choices)
+    ]
+
+# Questionnaire, rerun on its own when a question is answered. The whole app
+# only reruns once the last answer moves on to recommendations.
+@st.fragment
+@timed_step("questionnaire")
+def questionnaire():
+    # Display progress
+    total_questions = len(st.session_state.questions)
+    current_q = st.session_state.current_question + 1
+    st.progress(current_q / total_questions)
+    
+    st.markdown(f'<div class="retro-card crt-effect">', unsafe_allow_html=True)
+    
+    # Display current question
+    if st.session_state.current_question < len(st.session_state.questions):
+        question = st.session_state.questions[st.session_state.current_question]
+        
+        st.markdown(f"### Question {current_q}/{total_questions}")
+        st.markdown(f"## {question.text}")
+        
+        # Display options as buttons in a grid
+        option_count = len(question.options)
+        cols_per_row = min(4, option_count)
+        
+        # Create rows with appropriate number of columns
+        rows = (option_count + cols_per_row - 1) // cols_per_row
+        
+        for row in range(rows):
+            cols = st.columns(cols_per_row)
+            for col in range(cols_per_row):
+                idx = row * cols_per_row + col
+                if idx < option_count:
+                    with cols[col]:
+                        if st.button(question.options[idx], key=f"option_{idx}"):
+                            # Save the chosen option's index; get_answers() expands it
+                            st.session_state.choices.append(idx)
+                            
+                            # Move to next question
+                            st.session_state.current_question += 1
+                            
+                            # If all questions answered, move to recommendations
+                            if st.session_state.current_question >= len(st.session_state.questions):
+                                st.session_state.step = 'loading_recommendations'
+                                save_session()
+                                st.rerun()
+                            
+                            # Only the questionnaire needs to redraw for the next question
+                            save_session()
+                            maybe_start_speculation()
+                            rerun_fragment()
+    
+    st.markdown('</div>', unsafe_allow_html=True)
 
 # Main app flow
 def main():
+    # Pick up a stored session from the URL token, e.g. after a restart or on another replica
+    resume_session()
+    
     # Initialize session state variables
     if 'step' not in st.session_state:
         st.session_state.step = 'intro'
@@ -785,22 +3971,25 @@ def main():
     if 'persona' not in st.session_state:
         st.session_state.persona = None
     if 'questions' not in st.session_state:
-        st.session_state.questions = []
+        st.session_state.questions = ()
     if 'current_question' not in st.session_state:
         st.session_state.current_question = 0
-    if 'answers' not in st.session_state:
-        st.session_state.answers = []
+    if 'choices' not in st.session_state:
+        st.session_state.choices = []
     if 'recommendations' not in st.session_state:
         st.session_state.recommendations = []
-    if 'media_details' not in st.session_state:
-        st.session_state.media_details = []
     if 'load_more_count' not in st.session_state:
         st.session_state.load_more_count = 0
     if 'debug_mode' not in st.session_state:
         st.session_state.debug_mode = False
+    if 'variety' not in st.session_state:
+        st.session_state.variety = False
         
+    # Start pre-generating question sets as soon as the process serves its first page
+    get_question_pool()
+    
     # Log current app state at startup
-    logger.info(f"Current app state: {st.session_state.step}")
+    logger.info(f"Current app state: {st.session_state.step}", extra={"sample": True})
     
     # Check for API keys
     if not TMDB_API_KEY:
@@ -840,18 +4029,112 @@ def main():
             st.markdown(f"**Selected Persona:** {st.session_state.persona}")
             st.markdown(f"**Questions Count:** {len(st.session_state.questions)}")
             st.markdown(f"**Current Question:** {st.session_state.current_question}")
-            st.markdown(f"**Answers Count:** {len(st.session_state.answers)}")
+            st.markdown(f"**Answers Count:** {len(st.session_state.choices)}")
             st.markdown(f"**Recommendations Count:** {len(st.session_state.recommendations)}")
-            st.markdown(f"**Media Details Count:** {len(st.session_state.media_details)}")
+            st.markdown(f"**Session State Size:** {session_state_bytes() / 1024:.1f} KB")
             st.markdown(f"**Log File:** {log_filename}")
             
+            st.markdown("**HTTP Connections:**")
+            for host, stats in get_http_client().connection_stats().items():
+                st.markdown(f"- {host}: {stats['requests']} requests, {stats['reused']} reused, {stats['retries']} retries")
+            
+            pool_stats = get_question_pool().stats()
+            st.markdown(f"**Question Pool:** {pool_stats['fresh']} fresh sets, {pool_stats['hits']} served, {pool_stats['misses']} misses")
+            
+            if SPECULATIVE_PREFETCH:
+                spec_stats = get_speculation_stats().stats()
+                st.markdown(f"**Speculation:** {spec_stats['started']} started, {spec_stats['hits']} hits, {spec_stats['misses']} misses ({spec_stats['hit_rate']:.0%}), {spec_stats['timeouts']} timed out")
+                st.markdown(f"**Speculation Waste:** {spec_stats['wasted_runs']} runs, {spec_stats['wasted_recommendation_calls']} recommendation calls, {spec_stats['wasted_title_resolutions']} title resolutions")
+            
+            store_stats = get_recommendation_store().stats()
+            st.markdown(f"**Recommendation Cache:** {store_stats['hits']} hits, {store_stats['misses']} misses, {store_stats['entries']} entries ({store_stats['bytes'] / 1024:.1f} KB)")
+            
+            title_index = get_title_index()
+            if title_index:
+                st.markdown(f"**Title Index:** {title_index.count} titles, {title_index.hits} hits, {title_index.misses} misses")
+            
+            poster_stats = get_poster_cache().stats()
+            st.markdown(f"**Poster Cache:** {poster_stats['hits']} hits, {poster_stats['misses']} misses, {poster_stats['bytes'] / 1024:.1f} KB on disk")
+            
+            st.markdown("**Latency (p50 / p95 / p99):**")
+            for row in get_metrics().summary():
+                label = ", ".join(f"{k}={v}" for k, v in row["labels"].items())
+                st.markdown(
+                    f"- {row['name'].replace('svomo_', '').replace('_seconds', '')} {label}: "
+                    f"{row['p50'] * 1000:.0f} / {row['p95'] * 1000:.0f} / {row['p99'] * 1000:.0f} ms "
+                    f"({row['count']} calls, {row['errors']} errors)"
+                )
+
+            st.markdown("**Gemini Tokens (prompt / output):**")
+            token_usage = {}
+            for labels, value in get_metrics().counters("svomo_gemini_tokens_total"):
+                token_usage.setdefault((labels["purpose"], labels["model"]), {})[labels["direction"]] = value
+            for (purpose, model), usage in token_usage.items():
+                st.markdown(f"- {purpose} on {model}: {usage.get('prompt', 0)} / {usage.get('output', 0)}")
+
+            st.markdown("**Rate Limits:**")
+            for name, limiter in get_rate_limiters().items():
+                limit_stats = limiter.stats()
+                queued = ", ".join(f"{count} {priority}" for priority, count in limit_stats["queued"].items())
+                st.markdown(
+                    f"- {name}: {sum(limit_stats['acquired'].values())} admitted, queued {queued} "
+                    f"(max {limit_stats['max_depth']}), avg wait {limit_stats['avg_wait'] * 1000:.0f} ms, "
+                    f"{limit_stats['timeouts']} timeouts"
+                )
+            
+            st.markdown("**Circuit Breakers:**")
+            for name, breaker in get_circuit_breakers().items():
+                breaker_stats = breaker.stats()
+                st.markdown(
+                    f"- {name}: {breaker_stats['state']}, {breaker_stats['failure_ratio']:.0%} recent failures, "
+                    f"opened {breaker_stats['times_opened']} times, {breaker_stats['rejected']} rejected, {breaker_stats['probes']} probes"
+                )
+            
+            if GEMINI_HEDGING:
+                hedge_stats = get_hedge_stats().stats()
+                st.markdown(
+                    f"**Gemini Hedging:** {hedge_stats['hedge_rate']:.0%} of {hedge_stats['calls']} calls hedged, "
+                    f"{hedge_stats['win_rate']:.0%} of hedges won, {hedge_stats['budget_denied']} over budget, "
+                    f"~{hedge_stats['extra_tokens']} extra tokens"
+                )
+            
+            st.markdown("**Coalesced Requests:**")
+            for name, group in get_single_flights().items():
+                flight_stats = group.stats()
+                st.markdown(f"- {name}: {flight_stats['collapsed']} requests collapsed into {flight_stats['leaders']} upstream calls, {flight_stats['retried']} retried")
+            
+            session_store = get_session_store()
+            if session_store:
+                store_stats = session_store.stats()
+                st.markdown(
+                    f"**Session Store:** {store_stats['sessions']} sessions, {store_stats['bytes'] / 1024:.1f} KB, "
+                    f"{store_stats['resumed']} of {store_stats['loads']} lookups resumed, {store_stats['saves']} saves, "
+                    f"{store_stats['failed_saves']} failed, {store_stats['queued']} queued"
+                )
+            
+            media_stats = get_media_store().stats()
+            st.markdown(
+                f"**Media Store:** {media_stats['entries']} titles, {media_stats['bytes'] / 1024:.1f} KB shared, "
+                f"{media_stats['hits']} hits, {media_stats['misses']} misses, {media_stats['evictions']} evicted"
+            )
+            
+            cache_stats = get_tmdb_cache().stats()
+            st.markdown(f"**TMDB Cache:** {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%})")
+            st.markdown(f"**TMDB Cache Size:** {cache_stats['entries']} entries, {cache_stats['bytes'] / 1024:.1f} KB, {cache_stats['evictions']} evicted, {cache_stats['stale_hits']} served stale")
+            
             if st.button("View Session State"):
                 st.json(st.session_state)
                 
             if st.button("Reset Application"):
-                st.session_state.clear()
+                reset_session()
                 st.rerun()
     
+    # Draw the screen for the current step
+    render_step()
+
+# Screen for the current step, timed as a whole including runs that end in st.rerun()
+@timed_step(lambda: st.session_state.step)
+def render_step():
     # Introduction screen
     if st.session_state.step == 'intro':
         st.markdown('<div class="retro-card crt-effect">', unsafe_allow_html=True)
@@ -865,74 +4148,31 @@ def main():
         st.markdown('</div>', unsafe_allow_html=True)
         
         # Persona selection
-        persona_options = [
-            "Movie Fan - Hollywood",
-            "Movie Fan - Bollywood", 
-            "Movie Fan - Korean",
-            "Movie Fan - Japanese",
-            "Anime Enthusiast",
-            "TV Series Binger",
-            "Documentary Lover",
-            "Indie Film Aficionado"
-        ]
-        
         cols = st.columns(4)
-        for i, persona in enumerate(persona_options):
+        for i, persona in enumerate(PERSONA_OPTIONS):
             with cols[i % 4]:
                 if st.button(persona, key=f"persona_{i}"):
                     st.session_state.persona = persona
-                    # Generate questions based on persona
-                    loading_animation()
-                    st.session_state.questions = generate_questions(persona)
+                    # Serve a pre-generated question set, generating one only if the pool is empty
+                    questions = get_question_pool().take(persona)
+                    if not questions:
+                        logger.info(f"No pre-generated questions for {persona}, generating now")
+                        with st.spinner():
+                            loading_animation()
+                            questions = make_question_set(generate_questions(persona))
+                    st.session_state.questions = questions
                     st.session_state.step = 'questions'
+                    save_session()
                     st.rerun()
+        
+        st.session_state.variety = st.checkbox(
+            "Surprise me with fresh picks (skip saved recommendations)",
+            value=st.session_state.variety
+        )
     
     # Questions screen
     elif st.session_state.step == 'questions':
-        # Display progress
-        total_questions = len(st.session_state.questions)
-        current_q = st.session_state.current_question + 1
-        st.progress(current_q / total_questions)
-        
-        st.markdown(f'<div class="retro-card crt-effect">', unsafe_allow_html=True)
-        
-        # Display current question
-        if st.session_state.current_question < len(st.session_state.questions):
-            question = st.session_state.questions[st.session_state.current_question]
-            
-            st.markdown(f"### Question {current_q}/{total_questions}")
-            st.markdown(f"## {question['question']}")
-            
-            # Display options as buttons in a grid
-            option_count = len(question['options'])
-            cols_per_row = min(4, option_count)
-            
-            # Create rows with appropriate number of columns
-            rows = (option_count + cols_per_row - 1) // cols_per_row
-            
-            for row in range(rows):
-                cols = st.columns(cols_per_row)
-                for col in range(cols_per_row):
-                    idx = row * cols_per_row + col
-                    if idx < option_count:
-                        with cols[col]:
-                            if st.button(question['options'][idx], key=f"option_{idx}"):
-                                # Save answer
-                                answer = {
-                                    'question': question['question'],
-                                    'answer': question['options'][idx]
-                                }
-                                st.session_state.answers.append(answer)
-                                
-                                # Move to next question
-                                st.session_state.current_question += 1
-                                
-                                # If all questions answered, move to recommendations
-                                if st.session_state.current_question >= len(st.session_state.questions):
-                                    st.session_state.step = 'loading_recommendations'
-                                st.rerun()
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+        questionnaire()
     
     # Loading recommendations screen
     elif st.session_state.step == 'loading_recommendations':
@@ -942,56 +4182,66 @@ def main():
         st.markdown('</div>', unsafe_allow_html=True)
         
         try:
+            answers = get_answers()
+            
             # Log the current state
             logger.info(f"Getting recommendations for {st.session_state.persona}")
-            logger.info(f"User answers: {json.dumps(st.session_state.answers)}")
-            
-            # Get recommendations
-            recommendations = get_recommendations(st.session_state.answers, st.session_state.persona)
-            logger.info(f"Received {len(recommendations)} recommendations")
+            logger.info(f"User answered {len(answers)} questions")
+            logger.debug(f"User answers: {json.dumps(answers)}")
             
-            # Store recommendations in session state
-            st.session_state.recommendations = recommendations
+            # Identical persona and answers were resolved before unless the user wants variety
+            cache_key = make_recommendation_cache_key(st.session_state.persona, answers)
+            cached = None
+            if not st.session_state.variety:
+                cached = get_recommendation_store().get(cache_key)
             
-            # Display status for debugging
-            status_container = st.empty()
-            
-            # Get details for each recommendation
-            media_details = []
-            for idx, rec in enumerate(recommendations):
-                title = rec.get("title", "")
-                year = rec.get("year", "")
-                reason = rec.get("reason", "")
-                
-                # Show processing status
-                status_container.info(f"Processing recommendation {idx+1}/{len(recommendations)}: {title} ({year})")
-                logger.info(f"Searching for: {title} ({year})")
+            speculative = None if cached else take_speculation(answers, st.session_state.persona)
+            # The answers the results were actually computed from
+            source_answers = answers
+            if cached:
+                logger.info("Serving recommendations from the persistent cache")
+                cancel_speculation()
+                recommendations, media_details = cached
+            elif speculative:
+                # Speculation already did the work while the last questions were answered
+                recommendations, media_details, source_answers = speculative
+            elif GEMINI_STREAMING:
+                # Stream recommendations and show each card as soon as it is resolved
+                recommendations, media_details = stream_recommendation_cards(
+                    answers,
+                    st.session_state.persona
+                )
+                logger.info(f"Received {len(recommendations)} recommendations")
+            else:
+                # Get recommendations
+                recommendations = get_recommendations(answers, st.session_state.persona)
+                logger.info(f"Received {len(recommendations)} recommendations")
                 
-                # Search for the movie/show in TMDB
-                result = search_tmdb(title, year)
+                # Display status for debugging
+                status_container = st.empty()
                 
-                # Log search result
-                if result:
-                    logger.info(f"Found match for '{title}' in TMDB: {result.get('id')}")
-                else:
-                    logger.warning(f"No match found for '{title}' in TMDB")
-                    continue
+                # Resolve every recommendation in parallel
+                resolved = resolve_recommendations(
+                    recommendations,
+                    on_progress=lambda done, total, title: status_container.info(f"Processed recommendation {done}/{total}: {title}")
+                )
+                media_details = [details for details in resolved if details]
                 
-                # Get detailed information
-                details = get_media_details(result, reason)
-                if details:
-                    logger.info(f"Successfully got details for '{title}'")
-                    media_details.append(details)
-                else:
-                    logger.warning(f"Failed to get details for '{title}'")
-            
-            # Clear the status
-            status_container.empty()
+                # Clear the status
+                status_container.empty()
             
             logger.info(f"Processed {len(media_details)} media details")
             
-            # Store in session state
-            st.session_state.media_details = media_details
+            # Keep fully resolved results for the next user with the same answers,
+            # only if they were computed from exactly the answers in the key
+            if media_details and not cached:
+                if make_recommendation_cache_key(st.session_state.persona, source_answers) == cache_key:
+                    get_recommendation_store().put(cache_key, recommendations, media_details)
+                else:
+                    logger.warning("Not caching recommendations computed from different answers")
+            
+            # Store in session state; the titles themselves live in the media store
+            st.session_state.recommendations = media_details
             
             # If no recommendations found, add debugging info
             if not media_details:
@@ -1001,24 +4251,22 @@ def main():
                 else:
                     logger.error(f"Recommendations were generated but no TMDB matches found: {json.dumps(recommendations)}")
                 
-                # Add fallback recommendation
-                fallback = {
-                    "title": "The Matrix",
-                    "year": "1999",
-                    "poster_url": DEFAULT_IMAGE_URL,
-                    "overview": "A computer hacker learns from mysterious rebels about the true nature of his reality and his role in the war against its controllers.",
-                    "genres": "Action, Science Fiction",
-                    "ai_description": "This mind-bending sci-fi action film revolutionized visual effects with its 'bullet time' sequences. It combines philosophical themes with stunning action for a perfect movie night experience.",
-                    "media_type": "movie",
-                    "reason": "A universally acclaimed film that appeals to most viewers"
-                }
-                
-                media_details.append(fallback)
-                st.session_state.media_details = media_details
-                logger.info("Added fallback recommendation")
+                # Add fallback recommendation (The Matrix), fetched from TMDB like any
+                # other title so the shared media store only holds real details
+                fallback = get_media_store().lookup("movie", 603)
+                if fallback:
+                    media_details.append(Recommendation(
+                        fallback.media_type,
+                        fallback.media_id,
+                        "A universally acclaimed film that appeals to most viewers",
+                        "This mind-bending sci-fi action film revolutionized visual effects with its 'bullet time' sequences. It combines philosophical themes with stunning action for a perfect movie night experience."
+                    ))
+                    st.session_state.recommendations = media_details
+                    logger.info("Added fallback recommendation")
             
             # Move to recommendations screen
             st.session_state.step = 'recommendations'
+            save_session()
             st.rerun()
             
         except Exception as e:
@@ -1027,6 +4275,7 @@ def main():
             st.error(error_msg)
             # Add a fallback recommendation
             st.session_state.step = 'recommendations'
+            save_session()
             st.rerun()
     
     # Recommendations screen
@@ -1036,103 +4285,14 @@ def main():
         st.markdown(f"Based on your preferences as a {st.session_state.persona}")
         st.markdown('</div>', unsafe_allow_html=True)
         
-        # Display recommendations
-        if st.session_state.media_details:
-            for media in st.session_state.media_details:
-                display_media_card(media)
-            
-            # Load more button
-            if st.button("LOAD MORE RECOMMENDATIONS"):
-                st.session_state.load_more_count += 1
-                st.session_state.step = 'loading_more'
-                st.rerun()
-        else:
-            st.markdown('<div class="retro-card">', unsafe_allow_html=True)
-            st.markdown("## No recommendations found. Let's try again!")
-            if st.button("START OVER"):
-                st.session_state.clear()
-                st.rerun()
-            st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Start over button
-        if st.button("START OVER", key="restart_button"):
-            st.session_state.clear()
-            st.rerun()
+        recommendation_list()
     
     # Loading more recommendations
     elif st.session_state.step == 'loading_more':
-        st.markdown('<div class="retro-card crt-effect">', unsafe_allow_html=True)
-        st.markdown("## FINDING MORE RECOMMENDATIONS...")
-        st.markdown('<div class="loading-animation"></div>', unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Create a more specific prompt based on previous recommendations
-        previous_titles = ", ".join([media["title"] for media in st.session_state.media_details])
-        
-        answers_text = "\n".join([f"Q: {q['question']}\nA: {q['answer']}" for q in st.session_state.answers])
-        
-        prompt = f"""
-        Based on the following user preferences, recommend 3 MORE movies or shows that would be perfect for them.
-        
-        User persona: {st.session_state.persona}
-        
-        User responses:
-        {answers_text}
-        
-        Previously recommended: {previous_titles}
-        
-        Please recommend DIFFERENT titles that are still aligned with their preferences.
-        
-        For each recommendation, provide:
-        1. The exact title (be precise for API searching)
-        2. The release year
-        3. A brief explanation of why this is a good match
-        
-        Format your response as a JSON array:
-        [
-          {{
-            "title": "Movie Title",
-            "year": "YYYY",
-            "reason": "Brief explanation"
-          }},
-          ...
-        ]
-        """
-        
-        more_recommendations = call_gemini_api(prompt)
-        
-        try:
-            # Extract JSON from the response
-            json_start = more_recommendations.find('[')
-            json_end = more_recommendations.rfind(']') + 1
-            json_str = more_recommendations[json_start:json_end]
-            
-            new_recommendations = json.loads(json_str)
-            
-            # Get details for each new recommendation
-            new_media_details = []
-            for rec in new_recommendations:
-                title = rec.get("title", "")
-                year = rec.get("year", "")
-                reason = rec.get("reason", "")
-                
-                # Search for the movie/show in TMDB
-                result = search_tmdb(title, year)
-                
-                # Get detailed information
-                if result:
-                    details = get_media_details(result, reason)
-                    if details:
-                        new_media_details.append(details)
-            
-            # Add new recommendations to existing ones
-            st.session_state.media_details.extend(new_media_details)
-            st.session_state.step = 'recommendations'
-            st.rerun()
-        except Exception as e:
-            st.error(f"Error loading more recommendations: {e}")
-            st.session_state.step = 'recommendations'
-            st.rerun()
+        load_more_recommendations()
+        st.session_state.step = 'recommendations'
+        save_session()
+        st.rerun()
 
 if __name__ == "__main__":
     main()
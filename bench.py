@@ -0,0 +1,535 @@
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import streamlit.logger
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image
+
+# Offline benchmark for SVOMO. Local stand-in servers imitate TMDB and Gemini
+# with configurable latency and error rates, and the app's own functions are
+# driven against them:
+#
+#   python bench.py                              # all scenarios, results in bench_results.json
+#   python bench.py --scenario baseline --latency-scale 0.1
+#   python bench.py --output after.json --baseline before.json
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Canned payloads served by the stand-ins
+QUESTION_FIXTURE = [
+    {"question": "Are you watching alone or with someone?", "options": ["Alone", "With friends", "With family", "With a partner"]},
+    {"question": "What's your current mood?", "options": ["Happy", "Relaxed", "Sad", "Excited", "Thoughtful"]},
+    {"question": "How much time do you have?", "options": ["Under 2 hours", "A whole evening", "A weekend binge"]},
+    {"question": "Pick an era.", "options": ["Classic", "80s/90s", "Modern"]},
+    {"question": "How do you feel about subtitles?", "options": ["Love them", "Fine", "Rather not"]},
+    {"question": "Pick a setting.", "options": ["Space", "Big city", "Small town", "Fantasy world"]},
+    {"question": "How intense should it be?", "options": ["Light", "Balanced", "Edge of my seat"]},
+    {"question": "Animated or live action?", "options": ["Animated", "Live action", "Either"]},
+    {"question": "Something familiar or a surprise?", "options": ["Familiar", "Surprise me"]},
+    {"question": "How should it end?", "options": ["Happy", "Bittersweet", "Twist"]},
+]
+
+TITLE_FIXTURES = [
+    {"id": 603, "media_type": "movie", "title": "The Matrix", "date": "1999-03-30", "genres": ["Action", "Science Fiction"], "popularity": 84.2},
+    {"id": 329865, "media_type": "movie", "title": "Arrival", "date": "2016-11-10", "genres": ["Drama", "Science Fiction"], "popularity": 41.7},
+    {"id": 66732, "media_type": "tv", "title": "Stranger Things", "date": "2016-07-15", "genres": ["Drama", "Mystery"], "popularity": 211.5},
+    {"id": 1396, "media_type": "tv", "title": "Breaking Bad", "date": "2008-01-20", "genres": ["Drama", "Crime"], "popularity": 190.3},
+    {"id": 129, "media_type": "movie", "title": "Spirited Away", "date": "2001-07-20", "genres": ["Animation", "Family", "Fantasy"], "popularity": 95.1},
+    {"id": 194, "media_type": "movie", "title": "Amélie", "date": "2001-04-25", "genres": ["Comedy", "Romance"], "popularity": 38.6},
+]
+
+RECOMMENDATION_FIXTURE = [
+    {"title": "The Matrix", "year": "1999", "media_type": "movie", "reason": "Mind-bending action for a curious viewer",
+     "pitch": "Jack in, friend! Leather coats, bullet time and a question you'll chew on for days."},
+    {"title": "Arrival", "year": "2016", "media_type": "movie", "reason": "Thoughtful science fiction with heart",
+     "pitch": "Aliens, linguistics and a gut-punch of an ending. A first-contact film that rewires your brain."},
+    {"title": "Stranger Things", "year": "2016", "media_type": "tv", "reason": "Retro thrills for a weekend binge",
+     "pitch": "Bikes, synths and the Upside Down. Pure 80s nostalgia with monsters to match."},
+    # A non-ASCII title catches responses decoded with the wrong charset
+    {"title": "Amélie", "year": "2001", "media_type": "movie", "reason": "A whimsical pick-me-up",
+     "pitch": "Paris, crème brûlée and a shy matchmaker. Pure charm from the first frame to the last."},
+]
+
+DESCRIPTION_FIXTURE = "Grab the popcorn! This one is a radical ride you won't forget, packed with the vibes you asked for."
+
+# Benchmark scenarios. Latency is log-normal around median_ms with spread sigma
+# (0 for a constant delay); error_rate is the share of requests answered with
+# error_status. cold scenarios start every run with empty caches and pools.
+DEFAULT_SCENARIOS = [
+    {
+        "name": "baseline",
+        "cold": True,
+        "tmdb": {"median_ms": 40, "sigma": 0.3},
+        "gemini": {"median_ms": 700, "sigma": 0.35},
+    },
+    {
+        "name": "warm_cache",
+        "cold": False,
+        "tmdb": {"median_ms": 40, "sigma": 0.3},
+        "gemini": {"median_ms": 700, "sigma": 0.35},
+    },
+    {
+        "name": "legacy_prompts",
+        "cold": True,
+        "structured_output": False,
+        "tmdb": {"median_ms": 40, "sigma": 0.3},
+        "gemini": {"median_ms": 700, "sigma": 0.35},
+    },
+    {
+        "name": "slow_gemini",
+        "cold": True,
+        "tmdb": {"median_ms": 40, "sigma": 0.3},
+        "gemini": {"median_ms": 2500, "sigma": 0.5},
+    },
+    {
+        "name": "streaming",
+        "cold": True,
+        "streaming": True,
+        "tmdb": {"median_ms": 40, "sigma": 0.3},
+        "gemini": {"median_ms": 700, "sigma": 0.35},
+    },
+    {
+        "name": "flaky_upstream",
+        "cold": True,
+        "tmdb": {"median_ms": 60, "sigma": 0.6, "error_rate": 0.1, "error_status": 503},
+        "gemini": {"median_ms": 900, "sigma": 0.5, "error_rate": 0.05, "error_status": 503},
+    },
+]
+
+# Latency and error behaviour of one stand-in server
+class UpstreamProfile:
+    def __init__(self, median_ms=0, sigma=0.0, error_rate=0.0, error_status=503, scale=1.0, seed=None):
+        self.median = median_ms / 1000 * scale
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # Returns (delay in seconds, status to fail with or None)
+    def sample(self):
+        with self._lock:
+            delay = self.median * math.exp(self.sigma * self._random.gauss(0, 1)) if self.median else 0.0
+            failed = self._random.random() < self.error_rate
+        return delay, self.error_status if failed else None
+
+# Threaded HTTP server that counts requests per route
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, profile):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.profile = profile
+        self.counts = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def record(self, route, failed):
+        with self._lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+            if failed:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def take_counts(self):
+        with self._lock:
+            counts, errors = self.counts, self.errors
+            self.counts, self.errors = {}, {}
+        return counts, errors
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="bench-standin", daemon=True).start()
+        return self
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_payload(self, payload, status=200, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Apply the profile's latency; answers with an error and returns False when
+    # this request was picked to fail
+    def simulate(self, route):
+        delay, error_status = self.server.profile.sample()
+        self.server.record(route, error_status is not None)
+        time.sleep(delay)
+        if error_status is not None:
+            self.send_payload({"status_message": "Injected failure"}, error_status)
+            return False
+        return True
+
+# Imitates the TMDB endpoints the app uses, plus the image CDN
+class TmdbHandler(StandInHandler):
+    POSTER = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+
+        if path.startswith("/img/"):
+            self.server.record("image", False)
+            return self.send_payload(self.poster_bytes(), content_type="image/jpeg")
+
+        route = re.sub(r"/\d+$", "/{id}", path[len("/3/"):])
+        if not self.simulate(route):
+            return
+
+        if route == "configuration":
+            return self.send_payload({"images": {
+                "secure_base_url": f"{self.server.base_url}/img/",
+                "poster_sizes": ["w92", "w154", "w185", "w342", "w500", "w780", "original"],
+            }})
+
+        match = re.fullmatch(r"search/(movie|tv)", route)
+        if match:
+            title = query.get("query", [""])[0].strip().lower()
+            results = [self.search_result(fixture) for fixture in TITLE_FIXTURES
+                       if fixture["media_type"] == match.group(1) and fixture["title"].lower() == title]
+            return self.send_payload({"page": 1, "results": results, "total_results": len(results)})
+
+        match = re.fullmatch(r"/3/(movie|tv)/(\d+)", path)
+        if match:
+            for fixture in TITLE_FIXTURES:
+                if fixture["media_type"] == match.group(1) and fixture["id"] == int(match.group(2)):
+                    return self.send_payload(self.details(fixture))
+
+        self.send_payload({"status_message": "The resource you requested could not be found."}, 404)
+
+    def search_result(self, fixture):
+        name_field, date_field = ("title", "release_date") if fixture["media_type"] == "movie" else ("name", "first_air_date")
+        return {"id": fixture["id"], name_field: fixture["title"], date_field: fixture["date"],
+                "popularity": fixture["popularity"], "poster_path": f"/{fixture['id']}.jpg"}
+
+    def details(self, fixture):
+        details = self.search_result(fixture)
+        details["overview"] = f"The official overview of {fixture['title']}. " * 4
+        details["genres"] = [{"id": idx, "name": name} for idx, name in enumerate(fixture["genres"])]
+        return details
+
+    @classmethod
+    def poster_bytes(cls):
+        if cls.POSTER is None:
+            output = io.BytesIO()
+            Image.linear_gradient("L").resize((500, 750)).convert("RGB").save(output, "JPEG", quality=85)
+            cls.POSTER = output.getvalue()
+        return cls.POSTER
+
+# Imitates Gemini generateContent and streamGenerateContent, answering by
+# which of the app's prompts it was sent, and the model metadata endpoint
+class GeminiHandler(StandInHandler):
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if not self.simulate("model"):
+            return
+        self.send_payload({"name": path.rsplit("/", 1)[-1], "inputTokenLimit": 1048576, "outputTokenLimit": 8192})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = body["contents"][0]["parts"][0]["text"]
+        method = path.rsplit(":", 1)[-1]
+
+        if "sequential questions" in prompt:
+            kind, text = "questions", json.dumps(QUESTION_FIXTURE)
+        elif "responseSchema" in body.get("generationConfig", {}):
+            kind, text = "recommendations", json.dumps(RECOMMENDATION_FIXTURE, ensure_ascii=False)
+        elif "recommend 3" in prompt:
+            kind = "recommendations"
+            text = json.dumps([{"title": rec["title"], "year": rec["year"], "reason": rec["reason"]} for rec in RECOMMENDATION_FIXTURE], ensure_ascii=False)
+        elif "mapping each ID" in prompt:
+            ids = re.findall(r"ID: (\d+)", prompt)
+            kind, text = "descriptions", json.dumps({idx: DESCRIPTION_FIXTURE for idx in ids})
+        else:
+            kind, text = "descriptions", DESCRIPTION_FIXTURE
+
+        if not self.simulate(f"{method}/{kind}"):
+            return
+
+        usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4}
+        usage["totalTokenCount"] = usage["promptTokenCount"] + usage["candidatesTokenCount"]
+
+        if method == "streamGenerateContent":
+            chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+            events = b"".join(
+                b"data: " + json.dumps({
+                    "candidates": [{"content": {"parts": [{"text": chunk}]}}],
+                    "usageMetadata": usage
+                }, ensure_ascii=False).encode("utf-8") + b"\r\n\r\n"
+                for chunk in chunks
+            )
+            return self.send_payload(events, content_type="text/event-stream")
+        self.send_payload({
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": usage
+        })
+
+# Point a scratch directory's secrets at the stand-in servers
+def write_secrets(workdir, tmdb_url, gemini_url):
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as secrets_file:
+        secrets_file.write('TMDB_API_KEY = "bench"\n')
+        secrets_file.write('GEMINI_API_KEY = "bench"\n')
+        secrets_file.write(f'TMDB_BASE_URL = "{tmdb_url}/3"\n')
+        secrets_file.write(f'GEMINI_BASE_URL = "{gemini_url}/v1beta/models/bench:generateContent"\n')
+
+# Import app.py from a scratch directory whose secrets point at the stand-ins,
+# so caches, logs and metrics stay out of the working tree
+def load_app(workdir, tmdb_url, gemini_url):
+    write_secrets(workdir, tmdb_url, gemini_url)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    import app
+    app.POSTER_CACHE_DIR = os.path.join(workdir, "posters")
+    return app
+
+# Empty every process-wide cache, connection pool and upstream guard the workload
+# touches, so a cold run doesn't depend on which scenarios ran before it
+def reset_app(app):
+    for resource in (
+        app.get_tmdb_cache, app.get_gemini_response_cache, app.get_media_store, app.get_http_client,
+        app.get_poster_cache, app.get_metrics, app.get_circuit_breakers, app.get_rate_limiters,
+        app.get_single_flights, app.get_hedge_stats
+    ):
+        resource.clear()
+    shutil.rmtree(app.POSTER_CACHE_DIR, ignore_errors=True)
+
+# One user's journey: questions, recommendations, then search and details for each
+def run_workload(app, persona):
+    timings = {}
+
+    start_time = time.perf_counter()
+    questions = app.generate_questions(persona)
+    timings["generate_questions"] = time.perf_counter() - start_time
+
+    answers = [{"question": q["question"], "answer": q["options"][0]} for q in questions if q.get("options")]
+    start_time = time.perf_counter()
+    if app.GEMINI_STREAMING:
+        recommendations = list(app.stream_recommendations(answers, persona))
+    else:
+        recommendations = app.get_recommendations(answers, persona)
+    timings["get_recommendations"] = time.perf_counter() - start_time
+
+    timings["search_tmdb"] = 0.0
+    timings["get_media_details"] = 0.0
+    resolved = 0
+    for rec in recommendations:
+        start_time = time.perf_counter()
+        item = app.search_tmdb(rec["title"], rec.get("year"), rec.get("media_type"))
+        timings["search_tmdb"] += time.perf_counter() - start_time
+
+        # Mirror resolve_recommendation: a recommendation's pitch is its description
+        start_time = time.perf_counter()
+        details = app.get_media_details(item, rec.get("reason", ""), describe=not rec.get("pitch"))
+        timings["get_media_details"] += time.perf_counter() - start_time
+        if details:
+            resolved += 1
+
+    return timings, {"questions": len(questions), "recommendations": len(recommendations), "resolved": resolved}
+
+def run_scenario(app, scenario, servers, repeat, scale, seed, persona):
+    servers["tmdb"].profile = UpstreamProfile(**scenario.get("tmdb", {}), scale=scale, seed=seed)
+    servers["gemini"].profile = UpstreamProfile(**scenario.get("gemini", {}), scale=scale, seed=seed + 1)
+    app.GEMINI_STRUCTURED_OUTPUT = scenario.get("structured_output", True)
+    app.GEMINI_STREAMING = scenario.get("streaming", False)
+    cold = scenario.get("cold", True)
+
+    reset_app(app)
+    if not cold:
+        run_workload(app, persona)
+    for server in servers.values():
+        server.take_counts()
+
+    # Timed runs without tracing, then one traced run for allocations
+    runs = []
+    for _ in range(repeat):
+        if cold:
+            reset_app(app)
+        start_time = time.perf_counter()
+        timings, outcome = run_workload(app, persona)
+        wall = time.perf_counter() - start_time
+        calls = {name: server.take_counts() for name, server in servers.items()}
+        runs.append({"wall": wall, "timings": timings, "outcome": outcome, "calls": calls})
+
+    latency = app.get_metrics().summary()
+    connections = app.get_http_client().connection_stats()
+
+    if cold:
+        reset_app(app)
+    tracemalloc.start(25)
+    baseline_memory, _ = tracemalloc.get_traced_memory()
+    run_workload(app, persona)
+    current_memory, peak_memory = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, os.path.join(REPO_DIR, "app.py"))])
+    tracemalloc.stop()
+    for server in servers.values():
+        server.take_counts()
+
+    walls = [run["wall"] for run in runs]
+    upstream_calls = {}
+    upstream_errors = {}
+    for run in runs:
+        for name, (counts, errors) in run["calls"].items():
+            for route, count in counts.items():
+                key = f"{name}:{route}"
+                upstream_calls[key] = upstream_calls.get(key, 0) + count / repeat
+            for route, count in errors.items():
+                key = f"{name}:{route}"
+                upstream_errors[key] = upstream_errors.get(key, 0) + count / repeat
+
+    return {
+        "name": scenario["name"],
+        "config": scenario,
+        "repeat": repeat,
+        "wall_seconds": {
+            "median": statistics.median(walls),
+            "mean": statistics.mean(walls),
+            "min": min(walls),
+            "max": max(walls),
+            "runs": walls,
+        },
+        "function_seconds": {
+            name: statistics.median(run["timings"][name] for run in runs)
+            for name in runs[0]["timings"]
+        },
+        "outcome": runs[-1]["outcome"],
+        "upstream_calls_per_run": {key: round(value, 2) for key, value in sorted(upstream_calls.items())},
+        "upstream_errors_per_run": {key: round(value, 2) for key, value in sorted(upstream_errors.items())},
+        "client_latency": latency,
+        "client_connections": connections,
+        "allocations": {
+            "peak_bytes": peak_memory - baseline_memory,
+            "retained_bytes": current_memory - baseline_memory,
+            "top_retained_app_lines": [
+                {"line": f"app.py:{stat.traceback[0].lineno}", "bytes": stat.size, "blocks": stat.count}
+                for stat in snapshot.statistics("lineno")[:10]
+            ],
+        },
+    }
+
+# Print each scenario's change against an earlier results file
+def print_comparison(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = {scenario["name"]: scenario for scenario in json.load(baseline_file)["scenarios"]}
+
+    def change(before, after):
+        return f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+
+    print(f"\nCompared with {baseline_path}:")
+    for scenario in results["scenarios"]:
+        before = baseline.get(scenario["name"])
+        if not before:
+            print(f"  {scenario['name']}: not in baseline")
+            continue
+        calls_before = sum(before["upstream_calls_per_run"].values())
+        calls_after = sum(scenario["upstream_calls_per_run"].values())
+        print(
+            f"  {scenario['name']}: wall {change(before['wall_seconds']['median'], scenario['wall_seconds']['median'])}, "
+            f"calls {calls_before:g} -> {calls_after:g}, "
+            f"peak alloc {change(before['allocations']['peak_bytes'], scenario['allocations']['peak_bytes'])}"
+        )
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SVOMO benchmark against local TMDB and Gemini stand-ins")
+    parser.add_argument("--scenario", action="append", help="run only this scenario (repeatable)")
+    parser.add_argument("--scenarios-file", help="JSON list of scenarios to use instead of the defaults")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per scenario")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every stand-in latency by this factor")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--persona", default="Film Buff")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--log-level", default="WARNING", help="level for the app's own logger")
+    args = parser.parse_args()
+
+    scenarios = DEFAULT_SCENARIOS
+    if args.scenarios_file:
+        with open(args.scenarios_file, encoding="utf-8") as scenarios_file:
+            scenarios = json.load(scenarios_file)
+    if args.scenario:
+        scenarios = [scenario for scenario in scenarios if scenario["name"] in args.scenario]
+        if not scenarios:
+            parser.error(f"no scenario named {', '.join(args.scenario)}")
+
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    servers = {
+        "tmdb": StandInServer(TmdbHandler, UpstreamProfile()).start(),
+        "gemini": StandInServer(GeminiHandler, UpstreamProfile()).start(),
+    }
+
+    workdir = tempfile.mkdtemp(prefix="svomo-bench-")
+    try:
+        app = load_app(workdir, servers["tmdb"].base_url, servers["gemini"].base_url)
+        app.logger.setLevel(args.log_level.upper())
+        streamlit.logger.set_log_level("error")
+
+        results = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_scale": args.latency_scale,
+            "seed": args.seed,
+            "scenarios": [],
+        }
+        for scenario in scenarios:
+            print(f"Running {scenario['name']} ...", flush=True)
+            result = run_scenario(app, scenario, servers, args.repeat, args.latency_scale, args.seed, args.persona)
+            results["scenarios"].append(result)
+            print(
+                f"  wall median {result['wall_seconds']['median']:.3f}s, "
+                f"{sum(result['upstream_calls_per_run'].values()):g} upstream calls/run, "
+                f"peak alloc {result['allocations']['peak_bytes'] / 1024:.0f} KiB, "
+                f"resolved {result['outcome']['resolved']}/{result['outcome']['recommendations']}",
+                flush=True
+            )
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+        for server in servers.values():
+            server.shutdown()
+
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {output_path}")
+
+    if baseline_path:
+        print_comparison(results, baseline_path)
+
+if __name__ == "__main__":
+    main()
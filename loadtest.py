@@ -0,0 +1,321 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+import streamlit.config
+import streamlit.logger
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import app_test as app_test_module
+from streamlit.testing.v1 import local_script_runner as local_script_runner_module
+from bench import REPO_DIR, StandInServer, TmdbHandler, GeminiHandler, UpstreamProfile, write_secrets, git_revision
+
+# Multi-session load test for SVOMO. Each simulated user drives main()'s full
+# state machine (intro -> questions -> loading_recommendations ->
+# recommendations -> loading_more) through AppTest, all in this one process
+# against bench.py's stand-in servers, at increasing concurrency:
+#
+#   python loadtest.py                           # 1, 2, 4, 8, 16, 32 users
+#   python loadtest.py --users 4,8 --latency-scale 0.2
+#   python loadtest.py --secret SPECULATIVE_PREFETCH=true --output speculative.json
+
+LOAD_MORE_LABEL = "LOAD MORE RECOMMENDATIONS"
+
+# AppTest is built for one session at a time. It installs a mock Runtime for
+# the length of each run and removes it afterwards, which breaks other
+# sessions' runs still in flight, and compiles the script afresh per run, which
+# is not thread-safe on every Python. Share what a real server shares: keep the
+# most recent Runtime visible between runs, use one script cache, and pin the
+# testing flag that each run toggles.
+def share_test_runtime():
+    streamlit.config.set_option("global.appTest", True)
+    original_instance = Runtime.instance.__func__
+    latest = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest["runtime"] = cls._instance
+            return cls._instance
+        if "runtime" in latest:
+            return latest["runtime"]
+        return original_instance(cls)
+
+    def exists(cls):
+        return cls._instance is not None or "runtime" in latest
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+    script_cache = ScriptCache()
+    app_test_module.ScriptCache = lambda: script_cache
+    local_script_runner_module.ScriptCache = lambda: script_cache
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is the process-lifetime peak, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Samples resident memory in the background and keeps the peak
+class RssSampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-rss", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {"count": len(ordered), "p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": ordered[-1]}
+
+# One simulated user walking through the app once
+class SimulatedUser:
+    def __init__(self, app_path, seed, timeout, load_more):
+        self.app_path = app_path
+        self.random = random.Random(seed)
+        self.timeout = timeout
+        self.load_more = load_more
+        self.step_latencies = []
+        self.runs = 0
+        self.error = None
+        self.session_state_bytes = None
+        self.session_state_keys = {}
+
+    # Run the script once and attribute its time to the step the session was in.
+    # The answer that completes the questionnaire also produces the
+    # recommendations, so that run is counted as loading_recommendations.
+    def run(self, at, action=None, label=None):
+        step = at.session_state.get("step", "intro")
+        start_time = time.perf_counter()
+        (action or at).run()
+        elapsed = time.perf_counter() - start_time
+        self.runs += 1
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        if label is None:
+            label = step
+            if step == "questions" and at.session_state.get("step") != "questions":
+                label = "loading_recommendations"
+        self.step_latencies.append((label, elapsed))
+
+    def settle(self, at, label):
+        for _ in range(10):
+            if at.session_state.get("step") == "recommendations":
+                return
+            self.run(at, label=label)
+        raise RuntimeError(f"Session stuck in step {at.session_state.get('step')}")
+
+    def journey(self):
+        at = AppTest.from_file(self.app_path, default_timeout=self.timeout)
+        self.run(at)
+
+        personas = [button for button in at.button if (button.key or "").startswith("persona_")]
+        self.run(at, self.random.choice(personas).click())
+
+        while at.session_state.get("step") == "questions":
+            options = [button for button in at.button if (button.key or "").startswith("option_")]
+            if not options:
+                raise RuntimeError(f"No options rendered for question {at.session_state.get('current_question')}")
+            self.run(at, self.random.choice(options).click())
+        self.settle(at, "loading_recommendations")
+
+        for _ in range(self.load_more):
+            buttons = [button for button in at.button if button.label == LOAD_MORE_LABEL]
+            if not buttons:
+                raise RuntimeError("Load more button not rendered")
+            self.run(at, buttons[0].click(), label="loading_more")
+            self.settle(at, "loading_more")
+
+        if at.error:
+            raise RuntimeError(at.error[0].value)
+
+        # Imported here, once the scratch directory's secrets are in place;
+        # app.py is on the path as this script's own directory
+        from app import deep_sizeof
+        state = at.session_state.to_dict()
+        self.session_state_keys = {key: deep_sizeof(value) for key, value in state.items()}
+        self.session_state_bytes = sum(self.session_state_keys.values())
+
+    def __call__(self):
+        try:
+            self.journey()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+def run_level(app_path, users, args, level_seed):
+    simulated = [SimulatedUser(app_path, level_seed + i, args.timeout, args.load_more) for i in range(users)]
+    threads = [threading.Thread(target=user, name=f"loadtest-user-{i}") for i, user in enumerate(simulated)]
+
+    rss_before = current_rss()
+    start_time = time.perf_counter()
+    with RssSampler() as sampler:
+        for thread in threads:
+            thread.start()
+            if args.ramp:
+                time.sleep(args.ramp / users)
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - start_time
+
+    completed = [user for user in simulated if user.error is None]
+    steps = {}
+    for user in simulated:
+        for label, elapsed in user.step_latencies:
+            steps.setdefault(label, []).append(elapsed)
+    all_runs = [elapsed for user in simulated for _, elapsed in user.step_latencies]
+    state_sizes = [user.session_state_bytes for user in completed]
+    key_sizes = {}
+    for user in completed:
+        for key, size in user.session_state_keys.items():
+            key_sizes.setdefault(key, []).append(size)
+
+    error_rate = (users - len(completed)) / users
+    run_latency = percentiles(all_runs)
+    overloaded = error_rate > args.max_error_rate or (run_latency and run_latency["p95"] > args.slo)
+
+    return {
+        "users": users,
+        "wall_seconds": wall,
+        "completed_sessions": len(completed),
+        "error_rate": error_rate,
+        "errors": sorted({user.error for user in simulated if user.error})[:5],
+        "throughput": {
+            "sessions_per_second": len(completed) / wall,
+            "script_runs_per_second": sum(user.runs for user in simulated) / wall,
+        },
+        "run_latency_seconds": run_latency,
+        "step_latency_seconds": {label: percentiles(samples) for label, samples in sorted(steps.items())},
+        "memory": {
+            "rss_before_bytes": rss_before,
+            "peak_rss_bytes": sampler.peak,
+            "rss_after_bytes": current_rss(),
+        },
+        "session_state_bytes": {
+            "mean": statistics.mean(state_sizes) if state_sizes else None,
+            "max": max(state_sizes) if state_sizes else None,
+            "by_key_mean": {key: round(statistics.mean(sizes)) for key, sizes in sorted(key_sizes.items(), key=lambda item: -statistics.mean(item[1]))},
+        },
+        "overloaded": bool(overloaded),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for SVOMO using AppTest")
+    parser.add_argument("--users", default="1,2,4,8,16,32", help="comma-separated concurrency levels")
+    parser.add_argument("--load-more", type=int, default=1, help="LOAD MORE clicks per session")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which each level's users start")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-run AppTest timeout in seconds")
+    parser.add_argument("--slo", type=float, default=5.0, help="p95 script-run latency (s) above which a level counts as overloaded")
+    parser.add_argument("--max-error-rate", type=float, default=0.05, help="share of failed sessions above which a level counts as overloaded")
+    parser.add_argument("--keep-going", action="store_true", help="run every level even after one is overloaded")
+    parser.add_argument("--tmdb-ms", type=float, default=40, help="median TMDB stand-in latency")
+    parser.add_argument("--gemini-ms", type=float, default=700, help="median Gemini stand-in latency")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every stand-in latency by this factor")
+    parser.add_argument("--secret", action="append", default=[], help="extra secrets.toml line as KEY=TOML_VALUE (repeatable)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default="loadtest_results.json")
+    args = parser.parse_args()
+
+    levels = [int(users) for users in args.users.split(",") if users.strip()]
+    output_path = os.path.abspath(args.output)
+
+    servers = {
+        "tmdb": StandInServer(TmdbHandler, UpstreamProfile(args.tmdb_ms, 0.3, scale=args.latency_scale, seed=args.seed)).start(),
+        "gemini": StandInServer(GeminiHandler, UpstreamProfile(args.gemini_ms, 0.35, scale=args.latency_scale, seed=args.seed + 1)).start(),
+    }
+
+    # Run a copy of the app from a scratch directory so its caches, logs and
+    # poster files stay out of the working tree
+    workdir = tempfile.mkdtemp(prefix="svomo-loadtest-")
+    shutil.copy(os.path.join(REPO_DIR, "app.py"), workdir)
+    shutil.copytree(os.path.join(REPO_DIR, "static"), os.path.join(workdir, "static"), ignore=shutil.ignore_patterns("posters", "build"))
+    write_secrets(workdir, servers["tmdb"].base_url, servers["gemini"].base_url)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "a", encoding="utf-8") as secrets_file:
+        for secret in args.secret:
+            key, value = secret.split("=", 1)
+            secrets_file.write(f"{key.strip()} = {value.strip()}\n")
+    app_path = os.path.join(workdir, "app.py")
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key != "output"},
+        "levels": [],
+        "breaking_point": None,
+    }
+
+    os.chdir(workdir)
+    try:
+        share_test_runtime()
+
+        # One session on its own first, so process-wide resources are created
+        # before any level is measured
+        print("Warming up ...", flush=True)
+        warmup = SimulatedUser(app_path, args.seed - 1, args.timeout, 0)
+        warmup()
+        if warmup.error:
+            raise SystemExit(f"Warm-up session failed: {warmup.error}")
+        streamlit.logger.set_log_level("error")
+        logging.getLogger("svomo").setLevel(logging.WARNING)
+
+        for level_index, users in enumerate(levels):
+            print(f"Running {users} concurrent users ...", flush=True)
+            level = run_level(app_path, users, args, args.seed + 1000 * (level_index + 1))
+            results["levels"].append(level)
+            run_latency = level["run_latency_seconds"] or {}
+            print(
+                f"  {level['throughput']['sessions_per_second']:.2f} sessions/s, "
+                f"run p50/p95 {run_latency.get('p50', 0):.2f}/{run_latency.get('p95', 0):.2f}s, "
+                f"errors {level['error_rate']:.0%}, "
+                f"peak RSS {level['memory']['peak_rss_bytes'] / 1024 / 1024:.0f} MiB, "
+                f"session state {(level['session_state_bytes']['mean'] or 0) / 1024:.1f} KiB",
+                flush=True
+            )
+            if level["overloaded"] and results["breaking_point"] is None:
+                results["breaking_point"] = users
+                print(f"  Overloaded at {users} concurrent users", flush=True)
+                if not args.keep_going:
+                    break
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+        for server in servers.values():
+            server.shutdown()
+
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {output_path}")
+
+if __name__ == "__main__":
+    main()
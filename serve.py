@@ -0,0 +1,54 @@
+import os
+
+import streamlit as st
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+# Production entry point: `streamlit run serve.py`. It serves app.py unchanged,
+# adds the caching headers Streamlit's static handler leaves out and exposes
+# the app's metrics at /metrics.
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# Files under static/build carry a content hash in their name, so browsers and
+# proxies can keep them for a year without revalidating
+IMMUTABLE_PATH_PREFIX = "/app/static/build/"
+IMMUTABLE_CACHE_CONTROL = b"public, max-age=31536000, immutable"
+
+# ASGI middleware that marks the content-versioned build files as immutable
+class ImmutableStaticMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or IMMUTABLE_PATH_PREFIX not in scope["path"]:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_control(message):
+            if message["type"] == "http.response.start" and message["status"] in (200, 304):
+                headers = [(name, value) for name, value in message.get("headers", []) if name.lower() != b"cache-control"]
+                headers.append((b"cache-control", IMMUTABLE_CACHE_CONTROL))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_control)
+
+# Serve the metrics file this process's app last exported (see METRICS_EXPORT_PATH
+# in app.py). The script's registry lives in its own cache, out of reach from here,
+# so scrapes see numbers up to METRICS_EXPORT_INTERVAL seconds old.
+async def metrics(request):
+    path = st.secrets.get("METRICS_EXPORT_PATH", "metrics/svomo-{pid}.prom").format(pid=os.getpid())
+    try:
+        with open(path, encoding="utf-8") as metrics_file:
+            body = metrics_file.read()
+    except FileNotFoundError:
+        return PlainTextResponse("No metrics exported yet\n", status_code=503)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+app = st.App(
+    APP_SCRIPT,
+    routes=[Route("/metrics", metrics)],
+    middleware=[Middleware(ImmutableStaticMiddleware)]
+)